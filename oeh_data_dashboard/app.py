@@ -1,15 +1,26 @@
+import functools
+import logging
 import os
+import re
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import flask
 from dotenv import load_dotenv
 
+from oeh_data_dashboard import metrics
+
 from oeh_data_dashboard.fachportal import F
-from oeh_data_dashboard.index_info.attribute_distribution import layout as attr_layout
+from oeh_data_dashboard.fachportal.fachportal import Fachportal
+from oeh_data_dashboard.fachportal.metrics_history import METRICS_HISTORY_INTERVAL, METRICS_HISTORY_PATH
+from oeh_data_dashboard.oeh_elastic import AnalyticsRefresher, ServiceUnavailableError, collect_stale_results
+from oeh_data_dashboard.index_info import attribute_distribution
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # app stuff
 external_stylesheets = [
     {
@@ -18,30 +29,157 @@ external_stylesheets = [
         "rel": "stylesheet",
     },
 ]
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets,
-                suppress_callback_exceptions=True)
-app.title = "WLO Analytics"
-
-index_page = F.build_index_page()
-
-app.layout = html.Div([
-    dcc.Location(id='url', refresh=False),
-    dcc.Loading(
-            id="loading-1",
-            type="graph",
-            fullscreen=True,
-            children=[html.Div(id='page-content')]
+
+
+def create_app() -> dash.Dash:
+    """
+    Creates the dash app and registers its callbacks.
+    No data is queried here, the pages are built on request.
+    """
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets,
+                    suppress_callback_exceptions=True)
+    app.title = "WLO Analytics"
+
+    # metrics in the prometheus text format
+    app.server.add_url_rule("/metrics", "metrics", metrics_view)
+    app.server.after_request(observe_response_size)
+
+    app.layout = html.Div([
+        dcc.Location(id='url', refresh=False),
+        dcc.Loading(
+                id="loading-1",
+                type="graph",
+                fullscreen=True,
+                children=[html.Div(id='page-content')]
+                )
+               ]
             )
-           ]
-        )
 
+    # Update the index
+    app.callback(
+        dash.dependencies.Output('page-content', 'children'),
+        dash.dependencies.Input('url', 'pathname'))(display_page)
+
+    app.callback(
+        dash.dependencies.Output('coll-no-content-container', 'children'),
+        dash.dependencies.Input('my-slider', 'value'),
+        dash.dependencies.Input('url', 'pathname'), prevent_initial_call=True)(update_output)
+
+    app.callback(
+        dash.dependencies.Output('searched-materials-container', 'children'),
+        dash.dependencies.Input('searched-materials-window', 'value'),
+        dash.dependencies.State('url', 'pathname'), prevent_initial_call=True)(update_searched_materials)
+
+    app.callback(
+        dash.dependencies.Output('admin-window-tables', 'children'),
+        dash.dependencies.Input('admin-window', 'value'), prevent_initial_call=True)(update_admin_window_tables)
+
+    app.callback(
+        dash.dependencies.Output(
+            {"type": "missing-info-page", "index": dash.dependencies.MATCH, "page": dash.dependencies.ALL}, 'children'),
+        dash.dependencies.Output({"type": "missing-info-cursor", "index": dash.dependencies.MATCH}, 'data'),
+        dash.dependencies.Output({"type": "missing-info-more", "index": dash.dependencies.MATCH}, 'style'),
+        dash.dependencies.Input({"type": "missing-info-more", "index": dash.dependencies.MATCH}, 'n_clicks'),
+        dash.dependencies.State({"type": "missing-info-cursor", "index": dash.dependencies.MATCH}, 'data'),
+        prevent_initial_call=True)(load_more_missing_infos)
+
+    app.callback(
+        dash.dependencies.Output('empty-fp-output', 'children'),
+        dash.dependencies.Input('my-slider-all-fp', 'value'), prevent_initial_call=True)(update_empty_fp_overview)
+
+    app.callback(
+        dash.dependencies.Output({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'data'),
+        dash.dependencies.Output({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'page_count'),
+        dash.dependencies.Input({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'page_current'),
+        dash.dependencies.Input({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'page_size'),
+        dash.dependencies.Input({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'sort_by'),
+        dash.dependencies.Input({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'filter_query'),
+        dash.dependencies.State({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'id'),
+        prevent_initial_call=True)(update_server_side_table)
+
+    app.callback(
+        dash.dependencies.Output({"type": "server-side-table-download", "index": dash.dependencies.MATCH}, 'data'),
+        dash.dependencies.Input({"type": "server-side-table-export", "index": dash.dependencies.MATCH}, 'n_clicks'),
+        dash.dependencies.State({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'sort_by'),
+        dash.dependencies.State({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'filter_query'),
+        dash.dependencies.State({"type": "server-side-table", "index": dash.dependencies.MATCH}, 'id'),
+        prevent_initial_call=True)(export_server_side_table)
+
+    return app
+
+
+def metrics_view() -> flask.Response:
+    return flask.Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def observe_response_size(response: flask.Response) -> flask.Response:
+    method = flask.g.get("metrics_method")
+    if method is not None and response.content_length is not None:
+        metrics.observe_size(response.content_length, method)
+    return response
+
+
+def tracked_callback(func):
+    """
+    Tracks the calls of a dash callback, the size of its response is observed after the request.
+    """
+    tracked_func = metrics.tracked(ignore=(dash.exceptions.PreventUpdate,))(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if flask.has_request_context():
+            flask.g.metrics_method = func.__name__
+        return tracked_func(*args, **kwargs)
+    return wrapper
+
+
+# pathnames of the pages that are not a Fachportal, all unknown pathnames show the index page
+PAGE_PATHNAMES = ("/admin", "/empty_fp", "/attributes")
+# last page built from fresh results by the pathname of page_key, served if elastic or edu-sharing are not reachable
+last_pages: dict = {}
+
+
+def page_key(pathname: str) -> str:
+    """
+    Returns the pathname of the page build_page builds for pathname, "/" for the index page.
+    """
+    if pathname in PAGE_PATHNAMES or pathname in F.pathnames:
+        return pathname
+    return "/"
 
-# Update the index
-@ app.callback(
-    dash.dependencies.Output('page-content', 'children'),
-    dash.dependencies.Input('url', 'pathname'))
+
+@tracked_callback
 def display_page(pathname: str):
-    F.get_oeh_search_analytics()
+    try:
+        with collect_stale_results() as stale_sources:
+            page = build_page(pathname)
+        key = page_key(pathname)
+    except ServiceUnavailableError:
+        logger.exception(f"Could not build page: {pathname}")
+        try:
+            key = page_key(pathname)
+        except ServiceUnavailableError:
+            key = pathname
+        return build_stale_page(last_pages.get(key))
+    if stale_sources:
+        logger.warning(f"Built page {pathname} from stale results of: {', '.join(sorted(stale_sources))}")
+        return build_stale_page(page)
+    last_pages[key] = page
+    return page
+
+
+def build_stale_page(page):
+    if page is None:
+        notice = "Die Daten sind gerade nicht erreichbar. Bitte versuche es später noch einmal."
+    else:
+        notice = "Die Daten sind gerade nicht erreichbar. Es wird der letzte bekannte Stand angezeigt."
+    return html.Div(children=[
+        html.P(notice, className="stale-notice"),
+        page
+    ])
+
+
+def build_page(pathname: str):
     if pathname in F.pathnames:
         target_collection = next(collection for collection in F.collections if collection.app_url == pathname.removeprefix("/"))
         return target_collection.layout
@@ -50,16 +188,13 @@ def display_page(pathname: str):
     elif pathname == "/empty_fp":
         return F.empty_collections_layout
     elif pathname == "/attributes":
-        return attr_layout
+        return attribute_distribution.get_layout()
     else:
-        index_page = F.build_index_page()
+        index_page = F.get_index_page()
         return index_page
 
 
-@app.callback(
-    dash.dependencies.Output('coll-no-content-container', 'children'),
-    dash.dependencies.Input('my-slider', 'value'),
-    dash.dependencies.Input('url', 'pathname'), prevent_initial_call=True)
+@tracked_callback
 def update_output(value, pathname: str):
     target_collection = next(
         collection for collection in F.collections if collection.app_url == pathname.removeprefix("/")
@@ -68,17 +203,104 @@ def update_output(value, pathname: str):
     return target_collection.get_coll_no_content_layout()
 
 
-@app.callback(
-    dash.dependencies.Output('empty-fp-output', 'children'),
-    dash.dependencies.Input('my-slider-all-fp', 'value'), prevent_initial_call=True)
+@tracked_callback
+def update_searched_materials(window_days, pathname: str):
+    target_collection = next(
+        collection for collection in F.collections if collection.app_url == pathname.removeprefix("/")
+        )
+    return target_collection.get_searched_materials(window_days=int(window_days))
+
+
+@tracked_callback
+def update_admin_window_tables(window_days):
+    return F.build_window_tables(window_days=int(window_days))
+
+
+@tracked_callback
+def load_more_missing_infos(n_clicks, cursor: dict):
+    """
+    Loads the next page into the empty slot at the end of a missing info card, the loaded pages stay untouched.
+    """
+    target_collection = next(
+        collection for collection in F.collections if collection._id == cursor["fachportal"]
+        )
+    slot = cursor["page"]
+    try:
+        new_children, cursor = target_collection.load_more_missing_infos(cursor)
+    except ServiceUnavailableError:
+        logger.exception("Could not load more missing infos")
+        raise dash.exceptions.PreventUpdate
+    pages = [
+        new_children if output["id"]["page"] == slot else dash.no_update
+        for output in dash.callback_context.outputs_list[0]
+    ]
+    return pages, cursor, Fachportal.load_more_style(cursor)
+
+
+@tracked_callback
 def update_empty_fp_overview(value):
     return F.get_empty_fp_overview(doc_threshold=int(value))
 
 
+@tracked_callback
+def update_server_side_table(page_current: int, page_size: int, sort_by: list, filter_query: str, table_id: dict):
+    try:
+        return F.admin_tables.get_page(table_id["index"], page_current, page_size, sort_by, filter_query)
+    except KeyError:
+        logger.warning(f"Table is not available anymore: {table_id['index']}")
+        raise dash.exceptions.PreventUpdate
+
+
+@tracked_callback
+def export_server_side_table(n_clicks, sort_by: list, filter_query: str, table_id: dict):
+    try:
+        df = F.admin_tables.get_table(table_id["index"], sort_by, filter_query)
+    except KeyError:
+        logger.warning(f"Table is not available anymore: {table_id['index']}")
+        raise dash.exceptions.PreventUpdate
+    filename = re.sub(r"[^\w.-]+", "_", table_id["index"]) + ".csv"
+    return dcc.send_data_frame(df.to_csv, filename, index=False)
+
+
+def start_refresher() -> AnalyticsRefresher:
+    """
+    Warms up and keeps the search analytics and collection tree up to date in the background,
+    so the server is available right away instead of querying on every page view.
+    Records the metrics history in its own interval if METRICS_HISTORY_PATH is set,
+    the first sample after the warm-up, so it contains all clicks.
+    """
+    refresher = AnalyticsRefresher(F.refresh, warm_up=F.warm_up)
+    refresher.start()
+    if METRICS_HISTORY_PATH:
+        AnalyticsRefresher(
+            F.record_metrics,
+            interval=METRICS_HISTORY_INTERVAL,
+            warm_up=refresher.warmed_up.wait,
+            name="metrics-recorder"
+        ).start()
+    return refresher
+
+
+def create_server() -> flask.Flask:
+    """
+    Entry point for WSGI servers, e.g. gunicorn --workers 4 "oeh_data_dashboard.app:create_server()".
+    Every worker starts its own refresher, so the app must not be preloaded before the workers are forked.
+    """
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
+    start_refresher()
+    return app.server
+
+
 def run():
     import logging.config
     logging.basicConfig(level=logging.INFO)
-    app.run_server(host="0.0.0.0", debug=eval(os.getenv("DEBUG", True)), port=os.getenv("APP_PORT", 8050))
+    app = create_app()
+    debug = eval(os.getenv("DEBUG", "True"))
+    # in debug mode the reloader runs the app in a child process, only that one serves and refreshes
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_refresher()
+    app.run_server(host="0.0.0.0", debug=debug, port=os.getenv("APP_PORT", 8050))
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+from .replay import ReplaySession, ReplayTransport, ResponseStore, SyntheticElastic
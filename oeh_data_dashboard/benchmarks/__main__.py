@@ -0,0 +1,5 @@
+from .benchmark import main
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import tracemalloc
+from dataclasses import asdict, dataclass
+from math import inf
+from statistics import mean
+from time import perf_counter
+from typing import Callable
+
+from elasticsearch import Elasticsearch
+
+from oeh_data_dashboard.benchmarks.replay import (RecordingSession, RecordingTransport, ReplaySession,
+                                                  ReplayTransport, ResponseStore, SyntheticElastic)
+from oeh_data_dashboard.fachportal import F
+from oeh_data_dashboard.helper_classes import DayBuckets
+from oeh_data_dashboard.oeh_elastic import EduSharing, oeh
+from oeh_data_dashboard.oeh_elastic.oeh_elastic import ANALYTICS_WINDOW_DAYS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    runs: int
+    mean_seconds: float
+    min_seconds: float
+    es_requests: float  # per run
+    edu_sharing_requests: float  # per run
+    peak_memory_mb: float  # peak of memory allocated during one run
+
+    def as_row(self) -> str:
+        return (
+            f"{self.name:<36} {self.runs:>4} {self.mean_seconds * 1000:>10.1f} {self.min_seconds * 1000:>10.1f} "
+            f"{self.es_requests:>8.1f} {self.edu_sharing_requests:>8.1f} {self.peak_memory_mb:>9.1f}"
+        )
+
+
+HEADER = f"{'benchmark':<36} {'runs':>4} {'mean ms':>10} {'min ms':>10} {'es req':>8} {'edu req':>8} {'peak MB':>9}"
+
+
+def reset_analytics():
+    oeh.last_timestamp = f"now-{ANALYTICS_WINDOW_DAYS}d"
+    oeh.searched_materials_by_collection = {}
+    oeh.all_searched_materials = {}
+    oeh.materials_by_collection = {}
+    oeh.clicks_by_day = DayBuckets(ANALYTICS_WINDOW_DAYS)
+    oeh.search_strings_by_day = DayBuckets(ANALYTICS_WINDOW_DAYS)
+
+
+def reset_caches():
+    """
+    Empties all caches, so every run queries and renders everything.
+    """
+    if oeh.cache is not None:
+        oeh.cache.clear()
+    oeh.collection_tree = None
+    EduSharing.last_collections = None
+    EduSharing.pages = {}
+    F.render_cache.clear()
+    for collection in F.collections:
+        collection.render_cache.clear()
+
+
+def requests_count() -> tuple[int, int]:
+    return sum(oeh.es.transport.requests.values()), EduSharing.session.requests
+
+
+def measure(name: str, func: Callable[[], object], setup: Callable[[], None], runs: int) -> BenchmarkResult:
+    """
+    Times runs calls of func, setup is called before each of them and not timed.
+    A first untimed run imports the modules used by func.
+    The peak memory is measured in an additional run, as tracing the allocations slows down the calls.
+    """
+    setup()
+    func()
+
+    durations = []
+    es_before, edu_before = requests_count()
+    for _ in range(runs):
+        setup()
+        start = perf_counter()
+        func()
+        durations.append(perf_counter() - start)
+    es_after, edu_after = requests_count()
+
+    setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return BenchmarkResult(
+        name=name,
+        runs=runs,
+        mean_seconds=mean(durations),
+        min_seconds=min(durations),
+        es_requests=(es_after - es_before) / runs,
+        edu_sharing_requests=(edu_after - edu_before) / runs,
+        peak_memory_mb=peak / 1024 ** 2
+    )
+
+
+def run_benchmarks(runs: int = 3, warm: bool = False) -> list[BenchmarkResult]:
+    """
+    Runs the benchmarks against the client and edu-sharing session that are set up.
+
+    :param warm: keep the caches between the runs instead of emptying them before each run
+    """
+    setup = (lambda: None) if warm else reset_caches
+    fachportal = F.collections[0]
+
+    def setup_analytics():
+        setup()
+        reset_analytics()
+
+    # the analytics go first, the pages show the searched materials
+    benchmarks = [
+        ("get_oeh_search_analytics", lambda: oeh.get_oeh_search_analytics(count=inf), setup_analytics),
+        ("collections_by_fachportale", lambda: oeh.collections_by_fachportale(
+            doc_threshold=5, collection_ids=[collection._id for collection in F.collections]), setup),
+        ("Fachportal.update_properties", fachportal.update_properties, setup),
+        ("Fachportal.layout", lambda: fachportal.layout, setup),
+        ("FachportalIndex.admin_page_layout", lambda: F.admin_page_layout, setup),
+    ]
+    return [measure(name, func, setup_func, runs) for name, func, setup_func in benchmarks]
+
+
+def setup_synthetic(args) -> SyntheticElastic:
+    synthetic = SyntheticElastic(
+        fachportale=args.fachportale,
+        collections=args.collections,
+        materials=args.materials,
+        events=args.events
+    )
+    oeh.es = Elasticsearch(transport_class=ReplayTransport, fallback=synthetic)
+    EduSharing.session = ReplaySession(fallback=synthetic.edu_sharing)
+    return synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m oeh_data_dashboard.benchmarks",
+        description="Times the page builds against recorded or synthetic responses.")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument("--warm", action="store_true", help="keep the caches between the runs")
+    parser.add_argument("--replay", metavar="FILE", help="serve the responses recorded in FILE")
+    parser.add_argument("--record", metavar="FILE", help="query ES_HOST and edu-sharing and record the responses to FILE")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--fachportale", type=int, default=30)
+    parser.add_argument("--collections", type=int, default=6000)
+    parser.add_argument("--materials", type=int, default=100000)
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    store = None
+    if args.record:
+        store = ResponseStore()
+        oeh.es = Elasticsearch(hosts=oeh.es.transport.hosts, transport_class=RecordingTransport, store=store)
+        EduSharing.session = RecordingSession(store)
+    elif args.replay:
+        store = ResponseStore.load(args.replay)
+        oeh.es = Elasticsearch(transport_class=ReplayTransport, store=store)
+        EduSharing.session = ReplaySession(store)
+    else:
+        setup_synthetic(args)
+    # the benchmarks measure the page builds, not the fallbacks for an unreachable cluster
+    oeh.retry_policy.max_retries = 0
+
+    results = run_benchmarks(runs=args.runs, warm=args.warm)
+    if args.record:
+        store.save(args.record)
+
+    if args.json:
+        print(json.dumps([asdict(result) for result in results], indent=2))
+    else:
+        print(HEADER)
+        for result in results:
+            print(result.as_row())
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+
+import bisect
+import hashlib
+import json
+import random
+import sys
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+import requests
+from elasticsearch import RequestError, Transport
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+LICENSES = ["CC_0", "CC_BY", "CC_BY_SA", "CC_BY_NC", "PDM", "COPYRIGHT_FREE", "COPYRIGHT_LICENSE", "CUSTOM", "NONE"]
+# fields with a large number of distinct values and how many of them there are
+VOCABULARY_SIZES = {
+    "properties.cm:creator.keyword": 3000,
+    "searchString.keyword": 2000,
+    "properties.cclom:title.keyword": 10000,
+    "properties.cclom:general_description.keyword": 10000,
+    "properties.ccm:thumbnailurl.keyword": 10000,
+    "collections.path.keyword": 5000,
+}
+DEFAULT_VOCABULARY_SIZE = 50
+# fields of the indices that are not analyzed, all other fields are text with a .keyword subfield
+KEYWORD_FIELDS = {
+    "type",
+    "permissions.read",
+    "properties.cm:edu_metadataset",
+    "nodeRef.storeRef.protocol",
+    "timestamp",
+}
+
+
+class ResponseStore:
+    """
+    Recorded responses keyed by a hash of method, url, params and body, saved as a json file.
+    """
+
+    def __init__(self, responses: dict[str, Any] = None) -> None:
+        self.responses: dict[str, Any] = {} if responses is None else responses
+
+    @staticmethod
+    def make_key(method: str, url: str, params: dict = None, body: Any = None) -> str:
+        if isinstance(body, (bytes, str)):
+            body = body.decode() if isinstance(body, bytes) else body
+        else:
+            body = json.dumps(body, sort_keys=True, default=str)
+        params = sorted((key, str(value)) for key, value in (params or {}).items())
+        return hashlib.sha1(json.dumps([method, url, params, body]).encode()).hexdigest()
+
+    def get(self, method: str, url: str, params: dict = None, body: Any = None) -> Any:
+        return self.responses.get(self.make_key(method, url, params, body))
+
+    def record(self, method: str, url: str, params: dict, body: Any, response: Any):
+        self.responses[self.make_key(method, url, params, body)] = response
+
+    @classmethod
+    def load(cls, path: str) -> "ResponseStore":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.responses, f)
+
+
+class ReplayTransport(Transport):
+    """
+    Transport for the Elasticsearch client that serves responses from a ResponseStore instead of a cluster.
+    Requests without a recorded response are passed to fallback, e.g. a SyntheticElastic.
+
+    Use it with Elasticsearch(transport_class=ReplayTransport, store=..., fallback=...).
+    """
+
+    def __init__(
+        self,
+        hosts,
+        store: ResponseStore = None,
+        fallback: Callable[[str, str, dict, Any], Any] = None,
+        **kwargs
+    ) -> None:
+        super().__init__(hosts, **kwargs)
+        self.store = ResponseStore() if store is None else store
+        self.fallback = fallback
+        # number of requests by method and url
+        self.requests: Counter = Counter()
+
+    def perform_request(self, method: str, url: str, headers: dict = None, params: dict = None, body: Any = None):
+        self.requests[f"{method} {url}"] += 1
+        response = self.store.get(method, url, params, body)
+        if response is None and self.fallback is not None:
+            response = self.fallback(method, url, params, body)
+        if response is None:
+            raise KeyError(f"No recorded response for {method} {url}")
+        return response
+
+
+class RecordingTransport(Transport):
+    """
+    Transport for the Elasticsearch client that records all responses of a cluster in a ResponseStore.
+    """
+
+    def __init__(self, hosts, store: ResponseStore = None, **kwargs) -> None:
+        super().__init__(hosts, **kwargs)
+        self.store = ResponseStore() if store is None else store
+        self.requests: Counter = Counter()
+
+    def perform_request(self, method: str, url: str, headers: dict = None, params: dict = None, body: Any = None):
+        self.requests[f"{method} {url}"] += 1
+        response = super().perform_request(method, url, headers=headers, params=params, body=body)
+        self.store.record(method, url, params, body, response)
+        return response
+
+
+def json_response(data: Any, status_code: int = 200) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data).encode()
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+class ReplaySession:
+    """
+    Stand-in for the requests.Session of EduSharing, serving recorded or synthetic collection pages.
+    """
+
+    def __init__(self, store: ResponseStore = None, fallback: Callable[[str, dict], Any] = None) -> None:
+        self.store = ResponseStore() if store is None else store
+        self.fallback = fallback
+        self.requests: int = 0
+
+    def get(self, url: str, params: dict = None, headers: dict = None, timeout: float = None) -> requests.Response:
+        self.requests += 1
+        data = self.store.get("GET", url, params)
+        if data is None and self.fallback is not None:
+            data = self.fallback(url, params)
+        if data is None:
+            raise KeyError(f"No recorded response for GET {url}")
+        return json_response(data)
+
+
+class RecordingSession(requests.Session):
+    """
+    requests.Session that records the json responses of edu-sharing in a ResponseStore.
+    """
+
+    def __init__(self, store: ResponseStore = None) -> None:
+        super().__init__()
+        self.headers.update({"Accept": "application/json"})
+        self.store = ResponseStore() if store is None else store
+        self.requests: int = 0
+
+    def get(self, url: str, params: dict = None, **kwargs) -> requests.Response:
+        self.requests += 1
+        # request the whole page, so it can be recorded
+        kwargs.pop("headers", None)
+        response = super().get(url, params=params, **kwargs)
+        response.raise_for_status()
+        self.store.record("GET", url, params, None, response.json())
+        return response
+
+
+class SyntheticElastic:
+    """
+    Generates Elasticsearch responses for a synthetic dataset of Fachportale, collections, materials
+    and search analytics events. The queries are not evaluated, but the responses honor sizes,
+    search_after, terms queries on nodeRef.id.keyword, timestamp ranges and the requested aggregations,
+    so the dashboard pages through them like through a real cluster.
+    Sorts, aggregations and terms queries on text fields are rejected with a 400 error.
+    """
+
+    def __init__(
+        self,
+        fachportale: int = 30,
+        collections: int = 6000,
+        materials: int = 100000,
+        events: int = 20000,
+        seed: int = 1
+    ) -> None:
+        rng = random.Random(seed)
+        self.n_materials = materials
+
+        # Fachportale directly below the root, the other collections in two levels below them
+        self.fachportal_ids = [f"fp-{i:04d}" for i in range(fachportale)]
+        self.collections: list[dict] = []
+        self.collection_index: dict[str, int] = {}
+        for fachportal_id in self.fachportal_ids:
+            self.add_collection(fachportal_id, ["root"])
+        level_1 = []
+        for i in range(collections // 3):
+            fachportal_id = self.fachportal_ids[i % fachportale]
+            level_1.append(self.add_collection(f"coll-{len(self.collections):07d}", ["root", fachportal_id]))
+        while len(self.collections) < fachportale + collections:
+            parent = rng.choice(level_1)
+            self.add_collection(f"coll-{len(self.collections):07d}", parent["path"] + [parent["nodeRef"]["id"]])
+
+        # events of the last 29 days, oldest first, most clicks on a few materials
+        now = datetime.utcnow()
+        step = timedelta(days=29) / max(events, 1)
+        vocabulary = VOCABULARY_SIZES["searchString.keyword"]
+        self.events: list[dict] = []
+        for i in range(events):
+            self.events.append({
+                "action": "result_click" if rng.random() < 0.6 else "search",
+                "clickedResult": {"id": self.material_id(int(rng.paretovariate(1.2) * 10) % materials)},
+                "searchString": f"term-{int(rng.paretovariate(1.1)) % vocabulary}",
+                "timestamp": (now - timedelta(days=29) + i * step).strftime(TIMESTAMP_FORMAT)
+            })
+        self.timestamps = [event["timestamp"] for event in self.events]
+
+    def add_collection(self, _id: str, path: list[str]) -> dict:
+        collection = {
+            "nodeRef": {"id": _id},
+            "type": "ccm:map",
+            "path": path,
+            "properties": {"cm:title": f"Sammlung {_id}", "cm:name": _id}
+        }
+        self.collection_index[_id] = len(self.collections)
+        self.collections.append(collection)
+        return collection
+
+    @staticmethod
+    def material_id(i: int) -> str:
+        return f"{i:09d}"
+
+    def material(self, i: int) -> dict:
+        collection = self.collections[len(self.fachportal_ids) + i % (len(self.collections) - len(self.fachportal_ids))]
+        collection_id = collection["nodeRef"]["id"]
+        return {
+            "nodeRef": {"id": self.material_id(i)},
+            "type": "ccm:io",
+            "collections": [{"path": collection["path"] + [collection_id], "nodeRef": {"id": collection_id}}],
+            "properties": {
+                "cclom:title": f"Material {i}",
+                "cm:name": f"material-{i}",
+                "ccm:wwwurl": f"https://example.org/material/{i}",
+                "ccm:replicationsource": f"crawler-{i % 40}",
+                "cm:creator": f"creator-{i % VOCABULARY_SIZES['properties.cm:creator.keyword']}"
+            }
+        }
+
+    def __call__(self, method: str, url: str, params: dict = None, body: Any = None) -> Any:
+        if isinstance(body, (bytes, str)) and url.endswith("/_msearch"):
+            lines = [json.loads(line) for line in (body.decode() if isinstance(body, bytes) else body).splitlines() if line]
+            return {"responses": [
+                self.msearch_item(header.get("index"), search) for header, search in zip(lines[::2], lines[1::2])]}
+        elif url.endswith("/_pit"):
+            return {"succeeded": True} if method == "DELETE" else {"id": "synthetic-pit"}
+        elif url.endswith("/_search"):
+            index = url[1:-len("/_search")] or None
+            return self.search(index, body if isinstance(body, dict) else json.loads(body or "{}"))
+        return None
+
+    def msearch_item(self, index: str, body: dict) -> dict:
+        try:
+            return self.search(index, body)
+        except RequestError as e:
+            return {"error": e.info["error"], "status": e.status_code}
+
+    @classmethod
+    def check_fields(cls, node: Any):
+        """
+        Raises a RequestError like Elasticsearch for sorts, aggregations and terms queries on text fields.
+        A terms query on a text field does not fail in Elasticsearch, but it matches no whole value.
+        """
+        fields = []
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "sort":
+                    fields += [field for sort in value for field in ([sort] if isinstance(sort, str) else sort)]
+                elif key in ("terms", "missing") and isinstance(value, dict) and "field" in value:
+                    fields.append(value["field"])
+                elif key == "terms" and isinstance(value, dict) and "script" not in value:
+                    fields += [field for field in value if field != "boost"]
+                cls.check_fields(value)
+        elif isinstance(node, list):
+            for item in node:
+                cls.check_fields(item)
+        for field in fields:
+            if not field.endswith(".keyword") and field not in KEYWORD_FIELDS and not field.startswith("_"):
+                reason = (
+                    f"Text fields are not optimised for operations that require per-document field data, "
+                    f"use {field}.keyword instead"
+                )
+                raise RequestError(400, "search_phase_execution_exception", {
+                    "error": {"root_cause": [{"type": "illegal_argument_exception", "reason": reason}],
+                              "type": "search_phase_execution_exception", "reason": reason},
+                    "status": 400
+                })
+
+    def search(self, index: str, body: dict) -> dict:
+        self.check_fields(body)
+        if index == "oeh-search-analytics" or "pit" in body:
+            return self.search_analytics(body)
+
+        query = json.dumps(body.get("query", {}))
+        size = body.get("size", 10)
+        ids = body.get("query", {}).get("terms", {}).get("nodeRef.id.keyword")
+        if ids is not None:
+            hits = [self.hit(self.material(int(_id))) for _id in ids if _id.isdigit() and int(_id) < self.n_materials]
+            return self.response(hits, len(hits), body, len(hits))
+
+        if '"ccm:map"' in query:
+            total = len(self.collections)
+            if "collections.path" in query:
+                total //= len(self.fachportal_ids)
+            start = 0
+            if body.get("search_after"):
+                start = self.collection_index.get(body["search_after"][0], total) + 1
+            docs = self.collections[start:start + size]
+        else:
+            total = self.n_materials
+            if "collections.path" in query:
+                total //= len(self.fachportal_ids)
+            if '"must_not"' in query:
+                total = int(total * self.fraction(query))
+            start = int(body["search_after"][0]) + 1 if body.get("search_after") else 0
+            docs = [self.material(i) for i in range(start, min(start + size, total))]
+        return self.response([self.hit(doc) for doc in docs], total, body, total)
+
+    def search_analytics(self, body: dict) -> dict:
+        size = body.get("size", 10)
+        start = 0
+        time_range = body.get("query", {}).get("range", {}).get("timestamp", {})
+        gt = time_range.get("gt", "now")
+        if gt[:1].isdigit():
+            start = bisect.bisect_right(self.timestamps, gt)
+        if time_range.get("gte", "now")[:1].isdigit():
+            start = bisect.bisect_left(self.timestamps, time_range["gte"])
+        search_after = body.get("search_after")
+        if "desc" in json.dumps(body.get("sort")):
+            # newest first, without a point in time
+            end = bisect.bisect_left(self.timestamps, search_after[0]) if search_after else len(self.events)
+            hits = [
+                {"_source": event, "sort": [event["timestamp"]]}
+                for event in reversed(self.events[max(start, end - size):end])
+            ]
+            return self.response(hits, len(self.events) - start, body, len(self.events))
+        if search_after:
+            if len(search_after) > 1:
+                start = max(start, search_after[1] + 1)
+            else:
+                start = max(start, bisect.bisect_right(self.timestamps, search_after[0]))
+        hits = [
+            {"_source": event, "sort": [event["timestamp"], start + i] if "pit" in body else [event["timestamp"]]}
+            for i, event in enumerate(self.events[start:start + size])
+        ]
+        response = self.response(hits, len(self.events) - start, body, len(self.events))
+        if "pit" in body:
+            response["pit_id"] = body["pit"]["id"]
+        return response
+
+    def hit(self, doc: dict) -> dict:
+        return {"_index": "workspace", "_id": doc["nodeRef"]["id"], "_source": doc, "sort": [doc["nodeRef"]["id"]]}
+
+    def response(self, hits: list[dict], total: int, body: dict, doc_count: int) -> dict:
+        response = {
+            "took": 1,
+            "timed_out": False,
+            "hits": {"total": {"value": total, "relation": "eq"}, "hits": hits}
+        }
+        if body.get("aggs"):
+            response["aggregations"] = self.aggregate(body["aggs"], doc_count)
+        return response
+
+    @staticmethod
+    def fraction(key: Any) -> float:
+        """
+        Returns a stable fraction between 0 and 0.3 for key.
+        """
+        return zlib.crc32(json.dumps(key, sort_keys=True).encode()) % 300 / 1000
+
+    def aggregate(self, aggs: dict, doc_count: int) -> dict:
+        result = {}
+        for name, agg in aggs.items():
+            if "terms" in agg:
+                result[name] = self.terms_agg(agg["terms"]["field"], agg["terms"].get("size", 10), doc_count)
+                if "aggs" in agg:
+                    for bucket in result[name]["buckets"]:
+                        bucket.update(self.aggregate(agg["aggs"], bucket["doc_count"]))
+            elif "composite" in agg:
+                result[name] = self.composite_agg(agg["composite"], doc_count)
+            elif "missing" in agg:
+                result[name] = {"doc_count": int(doc_count * self.fraction(agg))}
+            elif "filters" in agg:
+                result[name] = {"buckets": {
+                    key: {"doc_count": int(doc_count * self.fraction(query))}
+                    for key, query in agg["filters"]["filters"].items()
+                }}
+            elif "filter" in agg:
+                result[name] = {"doc_count": doc_count, **self.aggregate(agg.get("aggs", {}), doc_count)}
+            else:
+                result[name] = {}
+        return result
+
+    def terms_agg(self, field: str, size: int, doc_count: int) -> dict:
+        if field == "collections.nodeRef.id.keyword":
+            per_collection = max(1, self.n_materials // len(self.collections))
+            keys = [collection["nodeRef"]["id"] for collection in self.collections[len(self.fachportal_ids):]]
+            buckets = [{"key": key, "doc_count": per_collection} for key in keys[:size]]
+            return {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0, "buckets": buckets}
+        if "license" in field:
+            keys = LICENSES
+        else:
+            keys = [f"{field.split(':')[-1].split('.')[0]}-{i}" for i in range(
+                VOCABULARY_SIZES.get(field, DEFAULT_VOCABULARY_SIZE))]
+        # zipf distributed counts, the most frequent value first
+        counts = [max(1, doc_count // (rank + 2)) for rank in range(len(keys))]
+        buckets = [{"key": key, "doc_count": count} for key, count in zip(keys[:size], counts)]
+        return {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": sum(counts[size:]),
+            "buckets": buckets
+        }
+
+    def subtree_buckets(self) -> list[dict]:
+        """
+        Returns the number of materials in or below each collection, every material is in a single collection.
+        """
+        per_collection = max(1, self.n_materials // len(self.collections))
+        counts = Counter()
+        for collection in self.collections[len(self.fachportal_ids):]:
+            for _id in collection["path"][1:] + [collection["nodeRef"]["id"]]:
+                counts[_id] += per_collection
+        return [{"key": key, "doc_count": count} for key, count in counts.items()]
+
+    def composite_agg(self, composite: dict, doc_count: int) -> dict:
+        """
+        Pages through the terms of a composite aggregation with a single terms source in the order of their keys.
+        """
+        (source_name, source), = composite["sources"][0].items()
+        if "script" in source["terms"]:
+            # the only script source is the one of the collection subtrees
+            buckets = self.subtree_buckets()
+        else:
+            buckets = self.terms_agg(source["terms"]["field"], sys.maxsize, doc_count)["buckets"]
+        buckets = sorted(buckets, key=lambda b: b["key"])
+        after = composite.get("after", {}).get(source_name)
+        if after is not None:
+            buckets = buckets[bisect.bisect_right([b["key"] for b in buckets], after):]
+        buckets = [{"key": {source_name: b["key"]}, "doc_count": b["doc_count"]} for b in buckets[:composite["size"]]]
+        if not buckets:
+            return {"buckets": []}
+        return {"after_key": buckets[-1]["key"], "buckets": buckets}
+
+    def edu_sharing(self, url: str, params: dict = None) -> dict:
+        """
+        Returns a page of the Fachportal collections of edu-sharing.
+        """
+        params = params or {}
+        skip_count = int(params.get("skipCount", 0))
+        max_items = int(params.get("maxItems", 100))
+        collections = [
+            {
+                "name": f"Fachportal {i}",
+                "title": f"Fachportal {i}",
+                "iconURL": "",
+                "content": {"url": f"https://example.org/collections/{_id}"},
+                "properties": {"sys:node-uuid": [_id], "ccm:taxonid": [str(i)]}
+            } for i, _id in enumerate(self.fachportal_ids)
+        ]
+        page = collections[skip_count:skip_count + max_items]
+        return {
+            "collections": page,
+            "pagination": {"total": len(collections), "from": skip_count, "count": len(page)}
+        }
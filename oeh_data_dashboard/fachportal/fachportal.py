@@ -1,16 +1,35 @@
 import logging
+from datetime import datetime
+from time import time
 from typing import Literal
 
 import dash_core_components as dcc
 import dash_html_components as html
-import plotly.graph_objects as go
-from oeh_data_dashboard.helper_classes import Licenses, MissingInfo, SearchedMaterialInfo, Slider
+from oeh_data_dashboard.helper_classes import Licenses, MissingInfo, MissingInfoPage, SearchedMaterialInfo, Slider
 from oeh_data_dashboard.oeh_elastic import oeh
+from oeh_data_dashboard.oeh_elastic.oeh_elastic import (ANALYTICS_WINDOW_DAYS, ANALYTICS_WINDOW_OPTIONS,
+                                                    MISSING_INFO_PAGE_SIZE)
 
 from oeh_data_dashboard.constants import ES_NODE_URL, ES_PREVIEW_URL
 
+from .metrics_history import CHANGE_DAYS, DAY, HISTORY_CHART_DAYS, MetricsHistory, changes
+from .render_cache import RenderCache
+
 logger = logging.getLogger(__name__)
 
+# metrics shown in the trend chart with their labels
+TREND_METRICS = {
+    "quality_score": "Datenqualitätsscore",
+    "resources_total": "Materialien",
+}
+# metrics shown with their change since CHANGE_DAYS days with their labels
+CHANGE_METRICS = {
+    "quality_score": "Datenqualitätsscore",
+    "resources_total": "Materialien",
+    "resources_no_licenses": "Materialien ohne Lizenz",
+    "clicks": f"Klicks (letzte {ANALYTICS_WINDOW_DAYS} Tage)",
+}
+
 
 class Fachportal:
     """
@@ -18,7 +37,21 @@ class Fachportal:
     It is NOT a pendant to an edu-sharing collection!
     """
 
-    def __init__(self, item: dict):
+    # missing info attributes of a Fachportal with their es-property and query type
+    missing_info_attributes: dict[str, tuple[str, str]] = {
+        "resources_no_licenses": (None, "license"),
+        "resources_no_educontext": ("properties.ccm:educationalcontext", "resource"),
+        "resources_no_subject_identifiers": ("properties.ccm:taxonid", "resource"),
+        "resources_no_title_identifiers": ("properties.cclom:title", "resource"),
+        "resources_no_keywords": ("properties.cclom:general_keyword", "resource"),
+        "collections_no_keywords": ("properties.cclom:general_keyword", "collection"),
+        "collections_no_description": ("properties.cm:description", "collection"),
+    }
+
+    def __init__(self, item: dict, metrics_history: MetricsHistory = None):
+        """
+        :param metrics_history: history of the metrics, to show their trends and changes
+        """
         self.name: str = item.get("name", None)  # internal name
         self.title: str = item.get("title", None)  # readable title
         # icon of edu-sharing collection
@@ -41,11 +74,19 @@ class Fachportal:
         self.resources_no_licenses: list[MissingInfo] = []
         self.collections_no_keywords: list[MissingInfo] = []
         self.collections_no_description: list[MissingInfo] = []
+        # number of documents for each of the missing_info_attributes
+        self.missing_counts: dict[str, int] = {name: 0 for name in self.missing_info_attributes}
+        # first page of missing infos for each of the missing_info_attributes
+        self.missing_info_pages: dict[str, MissingInfoPage] = {
+            name: MissingInfoPage() for name in self.missing_info_attributes}
         self.doc_threshold: int = 0
         # self._collections_no_content: list = []
         self._coll_no_content_layout = html.Div()
         self.quality_score: int = 0
         self._layout = html.Div()
+        # rendered layout, cards and figures, only rebuilt if their data changed
+        self.render_cache = RenderCache()
+        self.metrics_history = metrics_history
 
     def __lt__(self, other):
         return self.name < other.name
@@ -54,46 +95,100 @@ class Fachportal:
         return self.name
 
     def as_dict(self):
-        self.update_properties()
+        self.update_properties(counts_only=True)
         return {
             "name": self.name,
             "quality_score": self.quality_score,
             "clicked_materials": len(self.clicked_materials),
             "resources_total": self.resources_total,
-            "resources_no_title_identifiers": len(self.resources_no_title_identifiers),
-            "resources_no_subject_identifiers": len(self.resources_no_subject_identifiers),
-            "resources_no_educontext": len(self.resources_no_educontext),
-            "resources_no_keywords": len(self.resources_no_keywords),
+            "resources_no_title_identifiers": self.missing_counts["resources_no_title_identifiers"],
+            "resources_no_subject_identifiers": self.missing_counts["resources_no_subject_identifiers"],
+            "resources_no_educontext": self.missing_counts["resources_no_educontext"],
+            "resources_no_keywords": self.missing_counts["resources_no_keywords"],
             "oer_licenes": self.licenses.get("oer"),
-            "resources_no_licenses": len(self.resources_no_licenses),
-            "collections_no_keywords": len(self.collections_no_keywords),
-            "collections_no_description": len(self.collections_no_description)
+            "resources_no_licenses": self.missing_counts["resources_no_licenses"],
+            "collections_no_keywords": self.missing_counts["collections_no_keywords"],
+            "collections_no_description": self.missing_counts["collections_no_description"]
         }
 
-    def update_properties(self):
+    def update_properties(self, batched: bool = True, counts_only: bool = False):
         """
         Updates relevant properties with es-queries.
+
+        :param batched: send all queries in a single _msearch round trip
+        :param counts_only: only update the totals and counts, not the lists of missing infos
         """
         self.clicked_materials = oeh.searched_materials_by_collection.get(
             self._id, [])
-        self.resources_total = self.get_resources_total()
-        self.resources_no_licenses = self.get_missing_attribute(
-            None, qtype="license")
-        self.resources_no_educontext = self.get_missing_attribute(
-            "properties.ccm:educationalcontext", qtype="resource")
-        self.resources_no_subject_identifiers = self.get_missing_attribute(
-            "properties.ccm:taxonid", qtype="resource")
-        self.licenses = self.get_licenses()
-        self.resources_no_title_identifiers = self.get_missing_attribute(
-            "properties.cclom:title", qtype="resource")
-        self.resources_no_keywords = self.get_missing_attribute(
-            "properties.cclom:general_keyword", qtype="resource")
-        self.collections_no_keywords: list[MissingInfo] = self.get_missing_attribute(
-            "properties.cclom:general_keyword", qtype="collection")
-        self.collections_no_description: list[MissingInfo] = self.get_missing_attribute(
-            "properties.cm:description", qtype="collection")
-
-        self.quality_score = self.calc_quality_score()
+        if counts_only:
+            self.update_counts()
+        elif batched:
+            self.update_properties_batched()
+        else:
+            self.update_counts()
+            for name in self.missing_info_attributes:
+                self.set_missing_info_page(name, self.get_missing_info_page(name))
+
+    def update_properties_batched(self):
+        """
+        Collects the queries of all properties and updates them from one _msearch request.
+        """
+        searches = {"counts": ("workspace", self.quality_counts_body())}
+        for name, (attribute, qtype) in self.missing_info_attributes.items():
+            searches[name] = ("workspace", oeh.paginated_body(self.missing_attribute_query(attribute, qtype)))
+
+        responses = oeh.multi_query_elastic(searches)
+
+        for name, (attribute, qtype) in self.missing_info_attributes.items():
+            self.set_missing_info_page(name, self.parse_missing_info_page(responses[name], qtype))
+        self.set_counts(self.parse_counts(responses["counts"]))
+
+    def set_missing_info_page(self, name: str, page: MissingInfoPage):
+        self.missing_info_pages[name] = page
+        setattr(self, name, page.items)
+
+    def update_counts(self):
+        """
+        Updates resources_total, licenses, missing_counts and the quality_score with a single size 0 query.
+        """
+        self.set_counts(self.query_counts())
+
+    def query_counts(self) -> dict:
+        r: dict = oeh.query_elastic(body=self.quality_counts_body(), index="workspace", pretty=True)
+        return self.parse_counts(r)
+
+    def quality_counts_body(self) -> dict:
+        missing_filters = {
+            name: self.missing_attribute_query(attribute, qtype)
+            for name, (attribute, qtype) in self.missing_info_attributes.items()
+        }
+        return oeh.quality_counts_body(self._id, missing_filters)
+
+    def parse_counts(self, r: dict) -> dict:
+        """
+        Returns resources_total, missing_counts, licenses and the quality_score of a response to
+        the quality_counts_body, without changing the properties.
+        """
+        aggregations: dict = r.get("aggregations", {})
+        resources: dict = aggregations.get("resources", {})
+        missing_buckets: dict = aggregations.get("missing", {}).get("buckets", {})
+
+        resources_total = resources.get("doc_count", 0)
+        missing_counts = {
+            name: missing_buckets.get(name, {}).get("doc_count", 0) for name in self.missing_info_attributes}
+        return {
+            "resources_total": resources_total,
+            "missing_counts": missing_counts,
+            "licenses": self.sort_licenses(
+                resources.get("license", {}).get("buckets", []), missing_counts["resources_no_licenses"]),
+            "quality_score": self.calc_quality_score(missing_counts, resources_total)
+        }
+
+    def set_counts(self, counts: dict):
+        self.resources_total = counts["resources_total"]
+        self.missing_counts = counts["missing_counts"]
+        self.licenses = counts["licenses"]
+        self.quality_score = counts["quality_score"]
 
     @property
     def collections_no_content(self):
@@ -116,24 +211,81 @@ class Fachportal:
     def layout(self):
         logger.info("update properties")
         self.update_properties()
-        logger.info("Setting layout...")
-        return self.build_layout()
+        return self.render_cache.get("layout", self.layout_data(), self.build_layout)
 
-    def calc_quality_score(self):
+    def layout_data(self) -> tuple:
+        """
+        Returns the data the layout is built from, to rebuild it only if the data changed.
+        """
+        return (
+            self.name,
+            self.resources_total,
+            self.quality_score,
+            self.licenses,
+            self.doc_threshold,
+            self.missing_info_pages,
+            sorted(self.collections_no_content, key=lambda info: info._id),
+            self.searched_materials_data(oeh.clicks_in_window(self.clicked_materials)),
+            self.history_data()
+        )
+
+    def current_metrics(self) -> dict[str, float]:
+        """
+        Returns the metrics recorded in the history from the current properties.
+        """
+        counts = {
+            "resources_total": self.resources_total,
+            "missing_counts": self.missing_counts,
+            "licenses": self.licenses,
+            "quality_score": self.quality_score
+        }
+        return self.metrics(counts, self.clicked_materials)
+
+    def metrics_sample(self) -> dict[str, float]:
+        """
+        Returns the metrics recorded in the history from a single size 0 query.
+        The properties are left untouched, as the pages of the Fachportal may be built at the same time.
+        """
+        return self.metrics(self.query_counts(), oeh.searched_materials_by_collection.get(self._id, []))
+
+    @staticmethod
+    def metrics(counts: dict, clicked_materials: list[SearchedMaterialInfo]) -> dict[str, float]:
+        return {
+            "quality_score": counts["quality_score"],
+            "resources_total": counts["resources_total"],
+            **counts["missing_counts"],
+            **{f"licenses_{key}": value for key, value in counts["licenses"].items()},
+            "clicked_materials": len(clicked_materials),
+            "clicks": sum(clicks for _, clicks in oeh.clicks_in_window(clicked_materials)),
+        }
+
+    def history_data(self) -> tuple:
+        """
+        Returns the trends of the TREND_METRICS and the metrics CHANGE_DAYS days ago from the history,
+        None if there is no history.
+        """
+        if self.metrics_history is None:
+            return None
+        now = time()
+        series = self.metrics_history.series(self._id, now - HISTORY_CHART_DAYS * DAY, list(TREND_METRICS))
+        previous = self.metrics_history.values_at(now - CHANGE_DAYS * DAY, self._id).get(self._id, {})
+        return series, previous
+
+    def calc_quality_score(self, missing_counts: dict[str, int], resources_total: int):
         # TODO add licenses
         score_items = [
-            self.resources_no_title_identifiers,
-            self.resources_no_subject_identifiers,
-            self.resources_no_educontext,
-            self.resources_no_keywords,
-            self.collections_no_keywords,
-            self.collections_no_description
+            missing_counts["resources_no_title_identifiers"],
+            missing_counts["resources_no_subject_identifiers"],
+            missing_counts["resources_no_educontext"],
+            missing_counts["resources_no_keywords"],
+            missing_counts["collections_no_keywords"],
+            missing_counts["collections_no_description"]
         ]
         score = 0
 
         for item in score_items:
             try:
-                score += ((1 - (len(item) / self.resources_total)) /
+                score += ((1 - (item / resources_total)) /
                           len(score_items))
             except ZeroDivisionError:
                 logger.error(
@@ -142,7 +294,7 @@ class Fachportal:
 
         return round(score, 2) * 100
 
-    def sort_licenses(self, licenses):
+    def sort_licenses(self, licenses, missing: int):
         oer_cols = ["CC_0", "CC_BY", "CC_BY_SA", "PDM"]
         cc_but_not_oer = ["CC_BY_NC", "CC_BY_NC_ND",
                           "CC_BY_NC_SA", "CC_BY_SA_NC", "CC_BY_ND"]
@@ -170,21 +322,10 @@ class Fachportal:
 
         # some licenses are not counted here, because the property "properties.ccm:commonlicense_key.keyword"
         # does not exist on these resources. We have to add them by a query to count missing attributes
-        licenses_sorted["missing"] = len(self.resources_no_licenses)
+        licenses_sorted["missing"] = missing
 
         return licenses_sorted
 
-    def get_licenses(self):
-        r: list[dict] = oeh.getStatisicCounts(self._id, "properties.ccm:commonlicense_key.keyword").get(
-            "aggregations", {}).get("license", {}).get("buckets", [])
-        licenses = self.sort_licenses(r)
-        return licenses
-
-    def get_resources_total(self):
-        r: int = oeh.getStatisicCounts(self._id).get(
-            "hits", {}).get("total", {}).get("value", 0)
-        return r
-
     @classmethod
     def build_link_container(cls, list_of_values: list[MissingInfo]):
         container = []
@@ -235,10 +376,18 @@ class Fachportal:
             )
         return container
 
+    def get_license_fig(self) -> dict:
+        """
+        Returns the serialized license figure, only rebuilt if the licenses changed.
+        """
+        return self.render_cache.get("license_fig", self.licenses, lambda: self.build_license_fig().to_dict())
+
     def build_license_fig(self):
         """
         Builds a licenses Dataframe with columns: OER, CC-Lizenz, Copyright-Lizenz and Fehlende Lizenz.
         """
+        import plotly.graph_objects as go
+
         labels = ["OER", "CC-Lizenz", "Copyright-Lizenz", "Fehlende Lizenz"]
         sizes = list(self.licenses.values())
         pull = (0.1, 0, 0, 0)
@@ -253,26 +402,109 @@ class Fachportal:
 
         return fig
 
+    def build_history_card(self, history: tuple) -> html.Div:
+        """
+        Returns a card with the trends of the quality score and the number of materials
+        and the changes of the CHANGE_METRICS since CHANGE_DAYS days.
+        """
+        if history is None:
+            return html.Div()
+        series, previous = history
+        current = self.current_metrics()
+        change = changes({metric: current[metric] for metric in CHANGE_METRICS}, previous)
+        return html.Div(
+            className="card-box",
+            children=[
+                html.H3(f"Änderungen seit {CHANGE_DAYS} Tagen"),
+                html.Div(
+                    className="card",
+                    children=[
+                        *[html.P(f"{label}: {self.format_change(change[metric])}")
+                          for metric, label in CHANGE_METRICS.items()],
+                        dcc.Graph(id="history-chart", figure=self.build_history_fig(series).to_dict())
+                    ]
+                )
+            ]
+        )
+
+    @staticmethod
+    def format_change(change: float) -> str:
+        if change is None:
+            return "keine Daten"
+        change = round(change, 2)
+        if change == int(change):
+            change = int(change)
+        return f"{change:+}" if change else "±0"
+
+    @staticmethod
+    def build_history_fig(series: dict[str, list[tuple[int, float]]]):
+        """
+        Builds a line chart of the TREND_METRICS, the number of materials on a second axis.
+        """
+        import plotly.graph_objects as go
+
+        fig = go.Figure()
+        for axis, (metric, label) in zip(("y", "y2"), TREND_METRICS.items()):
+            samples = series.get(metric, [])
+            fig.add_trace(go.Scatter(
+                x=[datetime.fromtimestamp(at) for at, _ in samples],
+                y=[value for _, value in samples],
+                name=label,
+                mode="lines",
+                yaxis=axis
+            ))
+        fig.update_layout({
+            "yaxis2": {"overlaying": "y", "side": "right"},
+            "legend": {"orientation": "h"},
+            "margin": {"l": 20, "r": 20, "t": 20, "b": 20},
+            # make background transparent
+            "paper_bgcolor": "rgba(0,0,0,0)",
+            "plot_bgcolor": "rgba(0,0,0,0)"
+        })
+        return fig
+
     @classmethod
     def build_missing_info_card(
             cls,
             title: str,
             attribute: list,
             slider_config: Slider = None,
-            className: str = "card-box"
+            className: str = "card-box",
+            total: int = None,
+            cursor: dict = None
     ):
         """
         Returns a div with the infos for missing resources.
+
+        :param total: total number of missing infos, if attribute only holds the first page
+        :param cursor: pagination state (keys: fachportal, name, search_after, page) to load further pages
         """
+        if total is None:
+            total = len(attribute)
+        links = cls.build_link_container(attribute)
+        # paginated cards end with an empty slot that the next page is loaded into
+        items = html.Div(
+            children=[*links, cls.build_page_slot(cursor)] if cursor else links,
+            className="card"
+        )
         children = [
             html.P(
-                children=f"{title} ({len(attribute)}):"),
-            dcc.Loading
-                (html.Div(
-                children=cls.build_link_container(attribute),
-                className="card"
-            ))
+                children=f"{title} ({total}):"),
+            dcc.Loading(items)
         ]
+        if cursor:
+            children.extend([
+                dcc.Store(
+                    id={"type": "missing-info-cursor", "index": cursor["name"]},
+                    data=cursor
+                ),
+                html.Button(
+                    "Mehr laden",
+                    id={"type": "missing-info-more", "index": cursor["name"]},
+                    className="load-more-btn",
+                    style=cls.load_more_style(cursor)
+                )
+            ])
         if slider_config:
             if slider_config.value == 0:
                 p_string = f"Zeige Sammlungen mit {slider_config.value} Inhalten"
@@ -298,8 +530,86 @@ class Fachportal:
             className=className,
         )
 
+    @staticmethod
+    def build_page_slot(cursor: dict) -> html.Div:
+        """
+        Returns the empty container of the page of a missing info card that is loaded next,
+        so only the new page is sent to the browser.
+        """
+        return html.Div(id={"type": "missing-info-page", "index": cursor["name"], "page": cursor["page"]})
+
+    @staticmethod
+    def load_more_style(cursor: dict) -> dict:
+        """
+        Hides the load more button if there is no further page.
+        """
+        return {} if cursor.get("search_after") else {"display": "none"}
+
+    def get_missing_info_page_card(self, title: str, name: str):
+        """
+        Returns the missing info card of one of the missing_info_attributes, only rebuilt if its first page changed.
+        """
+        return self.render_cache.get(
+            name, (title, self.missing_info_pages[name]), lambda: self.build_missing_info_page_card(title, name))
+
+    def build_missing_info_page_card(self, title: str, name: str):
+        """
+        Returns a missing info card with the first page of one of the missing_info_attributes.
+        """
+        page = self.missing_info_pages[name]
+        cursor = {"fachportal": self._id, "name": name, "search_after": page.search_after, "page": 1}
+        return self.build_missing_info_card(title, page.items, total=page.total, cursor=cursor)
+
+    def load_more_missing_infos(self, cursor: dict) -> tuple[list, dict]:
+        """
+        Loads the page after the cursor of a missing info card.
+        Returns the new rows of the card followed by the slot of the next page and the updated cursor.
+        """
+        page = self.get_missing_info_page(cursor["name"], search_after=cursor["search_after"])
+        cursor = {**cursor, "search_after": page.search_after, "page": cursor["page"] + 1}
+        return [*self.build_link_container(page.items), self.build_page_slot(cursor)], cursor
+
+    @staticmethod
+    def searched_materials_data(materials: list[tuple[SearchedMaterialInfo, int]]) -> list[tuple]:
+        """
+        Returns the data of the searched materials shown in their table.
+        The search strings of a material only change with its clicks.
+        """
+        return [(material._id, material.title, material.name, clicks) for material, clicks in materials or []]
+
+    def get_searched_materials(self, window_days: int = ANALYTICS_WINDOW_DAYS) -> html.Div:
+        """
+        Returns the materials of the Fachportal clicked in the last window_days days.
+        """
+        materials = oeh.clicks_in_window(self.clicked_materials, window_days)
+        return self.render_cache.get(
+            f"searched_materials:{window_days}",
+            self.searched_materials_data(materials),
+            lambda: self.build_searched_materials(
+                f"Diese Materialien aus deinem Fachportal wurden gesucht und geklickt (~letzte {window_days} Tage)",
+                materials)
+        )
+
+    @staticmethod
+    def build_window_selector(_id: str) -> dcc.RadioItems:
+        """
+        Returns the selection of the number of days the search analytics are shown for.
+        """
+        return dcc.RadioItems(
+            id=_id,
+            options=[
+                {"label": "letzter Tag" if days == 1 else f"letzte {days} Tage", "value": days}
+                for days in ANALYTICS_WINDOW_OPTIONS
+            ],
+            value=ANALYTICS_WINDOW_DAYS,
+            labelStyle={"display": "inline-block", "margin-right": "10px"}
+        )
+
     @classmethod
-    def build_searched_materials(cls, title, materials: list[SearchedMaterialInfo] = []):
+    def build_searched_materials(cls, title, materials: list[tuple[SearchedMaterialInfo, int]] = []):
+        """
+        :param materials: the materials with their number of clicks in the shown window
+        """
         clicked_materials = []  # table elements
         search_term_count = "\"{}\" ({})"  # term, count
 
@@ -316,9 +626,9 @@ class Fachportal:
             style={"margin-bottom": "20px"}
         )
         clicked_materials.append(header_row)
-        for material in materials:
+        for material, clicks in materials:
             search_term_comprehension = " ".join([search_term_count.format(
-                term, count) for term, count in material.search_strings.items()])
+                term, count) for term, count in list(material.search_strings.items())])
             clicked_materials.append(
                 html.P(
                     children=[
@@ -331,7 +641,7 @@ class Fachportal:
                                             f"{material.title if material.title else material.name}"),
                                         html.Span(
                                             f"{search_term_comprehension}"),
-                                        html.Span(f"{material.clicks}"),
+                                        html.Span(f"{clicks}"),
                                         html.Img(
                                             src=ES_PREVIEW_URL.format(material._id))
                                     ]
@@ -355,23 +665,22 @@ class Fachportal:
         )
 
     def build_layout(self):
-        res_no_title = self.build_missing_info_card(
-            "Materialien ohne Titel", self.resources_no_title_identifiers)
-        res_no_subject = self.build_missing_info_card(
-            "Materialien ohne Fachzuordnung", self.resources_no_subject_identifiers)
-        res_no_educontext = self.build_missing_info_card(
-            "Materialien ohne Zuordnung der Bildungstufe", self.resources_no_educontext)
-        res_no_keywords = self.build_missing_info_card(
-            "Materialien ohne Schlagworte", self.resources_no_keywords)
-        res_no_license = self.build_missing_info_card(
-            "Materialien ohne Lizenz", self.resources_no_licenses)
-        coll_no_keywords = self.build_missing_info_card(
-            "Sammlungen ohne Schlagworte", self.collections_no_keywords)
-        coll_no_description = self.build_missing_info_card(
-            "Sammlung ohne Beschreibungstext", self.collections_no_description)
-        searched_materials = self.build_searched_materials(
-            "Diese Materialien aus deinem Fachportal wurden gesucht und geklickt (~letze 30 Tage)",
-            self.clicked_materials)
+        logger.info("Setting layout...")
+        res_no_title = self.get_missing_info_page_card(
+            "Materialien ohne Titel", "resources_no_title_identifiers")
+        res_no_subject = self.get_missing_info_page_card(
+            "Materialien ohne Fachzuordnung", "resources_no_subject_identifiers")
+        res_no_educontext = self.get_missing_info_page_card(
+            "Materialien ohne Zuordnung der Bildungstufe", "resources_no_educontext")
+        res_no_keywords = self.get_missing_info_page_card(
+            "Materialien ohne Schlagworte", "resources_no_keywords")
+        res_no_license = self.get_missing_info_page_card(
+            "Materialien ohne Lizenz", "resources_no_licenses")
+        coll_no_keywords = self.get_missing_info_page_card(
+            "Sammlungen ohne Schlagworte", "collections_no_keywords")
+        coll_no_description = self.get_missing_info_page_card(
+            "Sammlung ohne Beschreibungstext", "collections_no_description")
+        searched_materials = self.get_searched_materials()
         return html.Div(
             children=[
                 html.Div(
@@ -414,10 +723,11 @@ class Fachportal:
                                 html.Div(
                                     className="card",
                                     children=[
-                                        dcc.Graph(id="pie-chart", figure=self.build_license_fig()), ]
+                                        dcc.Graph(id="pie-chart", figure=self.get_license_fig()), ]
                                 )
                             ]
-                        )
+                        ),
+                        self.build_history_card(self.history_data())
                     ]
                 ),
                 html.H2(
@@ -453,35 +763,75 @@ class Fachportal:
                 html.Div(
                     className="info-row-2",
                     children=[
-                        searched_materials
+                        self.build_window_selector("searched-materials-window"),
+                        html.Div(
+                            id="searched-materials-container",
+                            children=searched_materials)
                     ]
                 )
             ]
         )
 
-    def get_missing_attribute(self, attribute, qtype: Literal["collection", "resource", "license"]):
+    def get_missing_info_page(self, name: str, search_after: list = None) -> MissingInfoPage:
+        """
+        Gets a page of missing infos for one of the missing_info_attributes.
+
+        :param name: key of missing_info_attributes
+        :param search_after: sort values of the last item of the previous page
+        """
+        attribute, qtype = self.missing_info_attributes[name]
+        return self.get_missing_attribute(attribute, qtype, search_after=search_after)
+
+    def get_missing_attribute(
+        self,
+        attribute,
+        qtype: Literal["collection", "resource", "license"],
+        search_after: list = None,
+        size: int = MISSING_INFO_PAGE_SIZE
+        ) -> MissingInfoPage:
         """
-        Gets the missing attributes
+        Gets a page of the missing attributes
+        """
+        body = oeh.paginated_body(
+            self.missing_attribute_query(attribute, qtype), size=size, search_after=search_after)
+        r: dict = oeh.query_elastic(body=body, index="workspace", pretty=True)
+        return self.parse_missing_info_page(r, qtype)
+
+    def missing_attribute_query(self, attribute, qtype: Literal["collection", "resource", "license"]) -> dict:
+        """
+        Returns a single query matching all documents with a missing attribute, e.g. to count them.
         """
         if qtype == "resource":
-            r: list = oeh.getMaterialByMissingAttribute(
-                self._id, attribute).get("hits", {}).get("hits", [])
+            return oeh.material_by_missing_attribute_query(self._id, attribute)
         elif qtype == "collection":
-            r: list = oeh.getCollectionByMissingAttribute(
-                self._id, attribute).get("hits", {}).get("hits", [])
+            return oeh.collection_by_missing_attribute_query(self._id, attribute)
         elif qtype == "license":
-            # some resources don't have a license keyword others have one, but it is NONE, "" or something strange
-            # so we need to combine this here
-            r1: list = oeh.get_material_by_condition(
-                self._id, condition="missing_license").get("hits", {}).get("hits", [])
-            r2: list = oeh.getMaterialByMissingAttribute(
-                self._id, attribute="properties.ccm:commonlicense_key.keyword").get("hits", {}).get("hits", [])
-            r: list = r1 + r2
+            return {
+                "bool": {
+                    "should": [
+                        oeh.material_by_condition_query(self._id, condition="missing_license"),
+                        oeh.material_by_missing_attribute_query(
+                            self._id, attribute="properties.ccm:commonlicense_key.keyword")
+                    ],
+                    "minimum_should_match": 1
+                }
+            }
         else:
             raise ValueError("qtype is not of: collection, resource, license")
-        result: list[MissingInfo] = [
-            self.parse_result(item, qtype) for item in r]
-        return result
+
+    def parse_missing_info_page(
+        self,
+        r: dict,
+        qtype: Literal["collection", "resource", "license"],
+        size: int = MISSING_INFO_PAGE_SIZE
+        ) -> MissingInfoPage:
+        hits: list = r.get("hits", {}).get("hits", [])
+        total: int = r.get("hits", {}).get("total", {}).get("value", 0)
+        items: list[MissingInfo] = [
+            self.parse_result(item, qtype) for item in hits]
+        # there can only be a further page if this one is full
+        search_after = hits[-1].get("sort") if len(hits) == size else None
+        return MissingInfoPage(items=items, total=total, search_after=search_after)
 
     def parse_result(self, resource: dict, qtype: Literal["collection", "resource", "license"]):
         _id = resource.get("_source", {}).get("nodeRef", {}).get("id", None)
@@ -1,14 +1,20 @@
 import logging
+from functools import partial
+from threading import Lock
+from time import time
 
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_react_wc
 import dash_table
-import pandas as pd
-from oeh_data_dashboard.helper_classes import Bucket
+from oeh_data_dashboard.helper_classes import Bucket, SearchedMaterialInfo
 from oeh_data_dashboard.oeh_elastic import EduSharing, oeh
+from oeh_data_dashboard.oeh_elastic.oeh_elastic import ANALYTICS_WINDOW_DAYS
 
 from .fachportal import Fachportal
+from .metrics_history import CHANGE_DAYS, DAY, METRICS_HISTORY_PATH, MetricsHistory, changes
+from .render_cache import RenderCache
+from .server_side_table import ServerSideTables
 from oeh_data_dashboard.constants import fpm_icons
 
 logger = logging.getLogger(__name__)
@@ -16,26 +22,106 @@ logger = logging.getLogger(__name__)
 
 class FachportalIndex:
     def __init__(self):
-        self.collections: list[Fachportal] = self.get_collections()
-        self.cards_for_index_page = self.build_cards_for_index_page()  # cards for index page
-        self.pathnames: list[str] = self.build_pathnames()  # the pathnames e.g. "/physik"
-        self.searched_materials_not_in_collections = oeh.searched_materials_by_collection.get("none")
+        self._collections: list[Fachportal] = None
+        self._cards_for_index_page: list = None  # cards for index page
+        self._pathnames: list[str] = None  # the pathnames e.g. "/physik"
+        self._collections_lock = Lock()
+        # materials in no Fachportal with their clicks in the last ANALYTICS_WINDOW_DAYS days
+        self.searched_materials_not_in_collections: list[tuple[SearchedMaterialInfo, int]] = []
         self.searched_materials_not_in_collections_layout = html.Div()
         self._admin_page_layout = html.Div()
+        # rendered index page and searched materials, only rebuilt if their data changed
+        self.render_cache = RenderCache()
+        # DataFrames of the admin tables, only the visible page is sent to the browser
+        self.admin_tables = ServerSideTables(shared=oeh.shared_store)
+        self._metrics_history: MetricsHistory = None
+        self._metrics_history_lock = Lock()
+
+    @property
+    def collections(self) -> list[Fachportal]:
+        """
+        The Fachportale, fetched from edu-sharing on first use.
+        """
+        with self._collections_lock:
+            if self._collections is None:
+                self._collections = self.get_collections()
+            return self._collections
+
+    @property
+    def metrics_history(self) -> MetricsHistory:
+        """
+        History of the metrics of the Fachportale, for their trends and changes.
+        Opened on first use, None if METRICS_HISTORY_PATH is not set.
+        """
+        with self._metrics_history_lock:
+            if self._metrics_history is None and METRICS_HISTORY_PATH:
+                self._metrics_history = MetricsHistory()
+            return self._metrics_history
+
+    @property
+    def cards_for_index_page(self) -> list:
+        if self._cards_for_index_page is None:
+            self._cards_for_index_page = self.build_cards_for_index_page()
+        return self._cards_for_index_page
+
+    @property
+    def pathnames(self) -> list[str]:
+        if self._pathnames is None:
+            self._pathnames = self.build_pathnames()
+        return self._pathnames
+
+    def warm_up(self):
+        """
+        Fetches the Fachportale and the initial search analytics, so the first page views are fast.
+        """
+        self.collections
+        oeh.warm_up()
+        self.update_searched_materials_not_in_collections()
+
+    def refresh(self):
+        """
+        Refreshes the collection tree and the search analytics.
+        The leader ingests the new search analytics events, the other workers load the analytics it published.
+        The role is checked on every refresh, so another worker takes over if the leader goes away.
+        """
+        oeh.refresh_collection_tree()
+        if oeh.is_leader():
+            self.get_oeh_search_analytics()
+        elif oeh.load_shared_analytics():
+            self.update_searched_materials_not_in_collections()
+
+    def record_metrics(self):
+        """
+        Records a sample of the metrics of all Fachportale in the history.
+        Only the leader records, so the workers do not add the same samples.
+        """
+        if self.metrics_history is None or not oeh.is_leader():
+            return
+        samples = oeh.run_concurrently(Fachportal.metrics_sample, self.collections)
+        self.metrics_history.record({item._id: sample for item, sample in zip(self.collections, samples)})
 
     def get_oeh_search_analytics(self):
-        oeh.get_oeh_search_analytics(timestamp=None)
-        self.searched_materials_not_in_collections = oeh.searched_materials_by_collection.get("none")
-        self.searched_materials_not_in_collections_layout = Fachportal.build_searched_materials("Geklickte Materialien, die in keinem Fachportal liegen (~letzte 30 Tage)", self.searched_materials_not_in_collections) #searched_materials
+        if not oeh.get_oeh_search_analytics(timestamp=None):
+            return
+        self.update_searched_materials_not_in_collections()
+
+    def update_searched_materials_not_in_collections(self):
+        self.searched_materials_not_in_collections = oeh.clicks_in_window(
+            oeh.searched_materials_by_collection.get("none"))
+        self.searched_materials_not_in_collections_layout = self.render_cache.get(
+            "searched_materials",
+            Fachportal.searched_materials_data(self.searched_materials_not_in_collections),
+            lambda: Fachportal.build_searched_materials(f"Geklickte Materialien, die in keinem Fachportal liegen (~letzte {ANALYTICS_WINDOW_DAYS} Tage)", self.searched_materials_not_in_collections) #searched_materials
+        )
 
     def build_pathnames(self):
         return ["/" + item.app_url for item in self.collections]
 
     def get_collections(self):
-        collections = sorted([Fachportal(item) for item in EduSharing.get_collections()])
+        collections = sorted([Fachportal(item, self.metrics_history) for item in EduSharing.get_collections()])
         return collections
 
-    def build_wordcloud(self) -> dash_react_wc:
+    def get_wordcloud_words(self) -> list[dict]:
         """
         Returns an array of dicts(keys: text, value) to build the wordcloud
         """
@@ -44,7 +130,11 @@ class FachportalIndex:
             index="oeh-search-analytics",
             size=50)
         words_buckets = oeh.build_buckets_from_agg(words_agg)
-        wc_words: list[dict] = [item.as_wc() for item in words_buckets]
+        return [item.as_wc() for item in words_buckets]
+
+    def build_wordcloud(self, wc_words: list[dict] = None) -> dash_react_wc:
+        if wc_words is None:
+            wc_words = self.get_wordcloud_words()
         options = {
             "rotationAngles": [0, 0],
             "rotations": 0,
@@ -60,8 +150,20 @@ class FachportalIndex:
         
         
 
-    def build_index_page(self):
-        wc = self.build_wordcloud()
+    def get_index_page(self):
+        """
+        Returns the index page, only rebuilt if the wordcloud, the Fachportale or the searched materials changed.
+        """
+        wc_words = self.get_wordcloud_words()
+        data = (
+            wc_words,
+            [item._id for item in self.collections],
+            Fachportal.searched_materials_data(self.searched_materials_not_in_collections)
+        )
+        return self.render_cache.get("index_page", data, lambda: self.build_index_page(wc_words))
+
+    def build_index_page(self, wc_words: list[dict] = None):
+        wc = self.build_wordcloud(wc_words)
         index_page = html.Div(
             children=[
                 wc,
@@ -99,14 +201,26 @@ class FachportalIndex:
         return index_links
 
     def build_fp_overview(self):
-        # build dataframe
-        d = [c.as_dict() for c in self.collections]
+        import pandas as pd
+
+        # build dataframe, querying the Fachportale concurrently
+        d = oeh.run_concurrently(Fachportal.as_dict, self.collections)
+        if self.metrics_history is not None:
+            previous = self.metrics_history.values_at(time() - CHANGE_DAYS * DAY)
+            for item, row in zip(self.collections, d):
+                change = changes(
+                    {"quality_score": row["quality_score"], "resources_total": row["resources_total"]},
+                    previous.get(item._id, {}))
+                row["quality_score_change"] = change["quality_score"]
+                row["resources_total_change"] = change["resources_total"]
         df = pd.DataFrame(d)
         df.rename(columns={
             "name": "Name",
             "quality_score": "Qualitäts-Score",
+            "quality_score_change": f"Δ Qualitäts-Score ({CHANGE_DAYS} Tage)",
             "clicked_materials": "Geklickte Materialien aus FP",
             "resources_total": "Materialien gesamt",
+            "resources_total_change": f"Δ Materialien ({CHANGE_DAYS} Tage)",
             "resources_no_title_identifiers": "Materialien ohne Titel",
             "resources_no_subject_identifiers": "Materialien ohne Fachzuordnung",
             "resources_no_educontext": "Materialien ohne Bildungsstufe",
@@ -118,7 +232,7 @@ class FachportalIndex:
         }, inplace=True)
 
         data_table = dash_table.DataTable(
-            id='table',
+            id='fp-overview-table',
             columns=[{"name": i, "id": i} for i in df.columns],
             data=df.to_dict('records'),
             sort_action="native",
@@ -133,20 +247,28 @@ class FachportalIndex:
         )
 
 
-    def build_data_table_for_agg(self, attribute: str, name: str, index: str = "workspace", size: int = 10000):
-        agg = oeh.get_aggregations(
-            attribute=attribute,
-            index=index,
-            size=size)
-        agg_buckets = oeh.build_buckets_from_agg(agg)
-        df = oeh.build_df_from_buckets(agg_buckets)
-        data_table = dash_table.DataTable(
-            id='table',
-            columns=[{"name": i, "id": i} for i in df.columns],
-            data=df.to_dict('records'),
-            sort_action="native",
-            style_table={'height': '300px', 'overflowY': 'auto'},
-            export_format="xlsx"
+    def build_data_table_for_agg(self, attribute: str, name: str, index: str = "workspace", size: int = None):
+        """
+        :param size: only show the size most frequent values with a single terms aggregation,
+            all values with a paged composite aggregation if None
+        """
+        if size is not None:
+            agg = oeh.get_aggregations(
+                attribute=attribute,
+                index=index,
+                size=size)
+            df = oeh.build_df_from_buckets(oeh.build_buckets_from_agg(agg))
+        else:
+            df = oeh.build_df_from_buckets(oeh.iter_aggregation_buckets(
+                attribute=attribute,
+                index=index))
+            # the buckets come in the order of their keys, show the most frequent values first
+            df = df.sort_values("doc_count", ascending=False, kind="mergesort", ignore_index=True)
+        data_table = self.admin_tables.build_data_table(
+            f"{index}:{attribute}",
+            df,
+            export=True,
+            style_table={'height': '300px', 'overflowY': 'auto'}
         )
         return html.Div(
             children=[
@@ -155,11 +277,24 @@ class FachportalIndex:
                 ])
 
 
-    def build_data_table_crawler(self, name: str):
-        data = oeh.sort_searched_materials()
-        d = [b.as_dict() for b in data]
-        df = pd.DataFrame(d)
-        df = df[["title", "search_strings", "clicks", "crawler", "local_timestamp"]]
+    def build_window_tables(self, window_days: int = ANALYTICS_WINDOW_DAYS) -> list:
+        """
+        Returns the tables of the search analytics in the last window_days days.
+        They are counted from the daily counts in memory, so changing the window does not query elastic.
+        """
+        return [
+            self.build_data_table_crawler(
+                f"Geklickte Materialien nach Quellen (letzte {window_days} Tage)", window_days),
+            self.build_data_table_search_strings(
+                f"Suchbegriffe geklickter Materialien (letzte {window_days} Tage)", window_days),
+        ]
+
+    def build_data_table_crawler(self, name: str, window_days: int = ANALYTICS_WINDOW_DAYS):
+        import pandas as pd
+
+        data = oeh.clicks_in_window(oeh.sort_searched_materials(), window_days)
+        d = [{**material.as_dict(), "clicks": clicks} for material, clicks in data]
+        df = pd.DataFrame(d, columns=["title", "search_strings", "clicks", "crawler", "local_timestamp"])
         df.rename(columns={
             "title": "Titel",
             "clicks": "Klicks",
@@ -167,13 +302,26 @@ class FachportalIndex:
             "crawler": "Crawler",
             "local_timestamp": "Letzter Click"
         },inplace=True)
-        data_table = dash_table.DataTable(
-            id='table',
-            columns=[{"name": i, "id": i} for i in df.columns],
-            data=df.to_dict('records'),
-            sort_action="native",
-            style_table={'height': '300px', 'overflowY': 'auto'},
-            export_format="xlsx"
+        data_table = self.admin_tables.build_data_table(
+            f"crawler:{window_days}",
+            df,
+            export=True,
+            style_table={'height': '300px', 'overflowY': 'auto'}
+        )
+        return html.Div(
+            className="info-row-2",
+            children=[
+                html.P(name),
+                data_table
+            ])
+
+    def build_data_table_search_strings(self, name: str, window_days: int = ANALYTICS_WINDOW_DAYS):
+        df = oeh.build_df_from_buckets(oeh.search_strings_in_window(window_days))
+        data_table = self.admin_tables.build_data_table(
+            f"search_strings:{window_days}",
+            df,
+            export=True,
+            style_table={'height': '300px', 'overflowY': 'auto'}
         )
         return html.Div(
             className="info-row-2",
@@ -186,31 +334,42 @@ class FachportalIndex:
     @property
     def admin_page_layout(self):
         logger.info("Build admin page...")
+        # build the tables concurrently, each of them runs its own queries
+        futures = [oeh.submit(build) for build in [
+            partial(
+                self.build_data_table_for_agg,
+                attribute="i18n.de_DE.ccm:educationallearningresourcetype.keyword",
+                name="Learning Resource Typen"),
+            partial(
+                self.build_data_table_for_agg,
+                attribute="i18n.de_DE.ccm:oeh_widgets.keyword",
+                name="Widget Typen"),
+            partial(
+                self.build_data_table_for_agg,
+                attribute="properties.cm:creator.keyword",
+                name="Uploads der FPs"),
+            partial(
+                self.build_data_table_for_agg,
+                attribute="searchString.keyword",
+                name="Meist gesuchter Begriff",
+                index="oeh-search-analytics",
+                size=1000),
+            self.build_window_tables,
+        ]]
+        # the overview queries the Fachportale in the pool itself, so it is built in this thread
         fp_data_table = self.build_fp_overview()
-        lrt_data_table = self.build_data_table_for_agg(
-            attribute="i18n.de_DE.ccm:educationallearningresourcetype.keyword",
-            name="Learning Resource Typen")
-        widget_data_table = self.build_data_table_for_agg(
-            attribute="i18n.de_DE.ccm:oeh_widgets.keyword",
-            name="Widget Typen"
-            )
-        creator_data_table = self.build_data_table_for_agg(
-            attribute="properties.cm:creator.keyword",
-            name="Uploads der FPs"
-        )
-        most_searched_term_data_table = self.build_data_table_for_agg(
-            attribute="searchString.keyword",
-            name="Meist gesuchter Begriff",
-            index="oeh-search-analytics",
-            size=1000
-        )
-
-        cralwer_data_table = self.build_data_table_crawler("Geklickte Materialien nach Quellen (letzte 30 Tage)")
-
+        (
+            lrt_data_table,
+            widget_data_table,
+            creator_data_table,
+            most_searched_term_data_table,
+            window_tables
+        ) = [future.result() for future in futures]
 
         return html.Div(children=[
             fp_data_table,
-            cralwer_data_table,
+            Fachportal.build_window_selector("admin-window"),
+            html.Div(id="admin-window-tables", children=window_tables),
             most_searched_term_data_table,
             html.Div(
                 className="info-row-1",
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# path of the sqlite file with the history of the Fachportal metrics, no history is recorded if empty
+METRICS_HISTORY_PATH = os.getenv("METRICS_HISTORY_PATH", "")
+METRICS_HISTORY_INTERVAL = int(os.getenv("METRICS_HISTORY_INTERVAL", 3600))  # seconds between two samples
+METRICS_HISTORY_RETENTION_DAYS = int(os.getenv("METRICS_HISTORY_RETENTION_DAYS", 365))
+HISTORY_CHART_DAYS = 90  # days shown in the trend charts
+CHANGE_DAYS = 7  # the changes are shown against the latest sample of this many days ago
+DAY = 24 * 3600  # seconds
+
+
+class MetricsHistory:
+    """
+    Time series of the metrics of the Fachportale in a sqlite file, one row per Fachportal, metric and sample time.
+    The pages read the trends and changes from here, so they do not need any es-queries.
+    """
+
+    def __init__(self, path: str = METRICS_HISTORY_PATH, retention_days: int = METRICS_HISTORY_RETENTION_DAYS) -> None:
+        self.path = path
+        self.retention_days = retention_days
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS samples (fachportal TEXT, metric TEXT, time INTEGER, value REAL, "
+                "PRIMARY KEY (fachportal, metric, time)) WITHOUT ROWID")
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def record(self, samples: dict[str, dict[str, float]], at: float = None):
+        """
+        Adds a sample of the metrics by Fachportal id and removes the samples older than the retention.
+
+        :param at: epoch seconds of the sample, default: now
+        """
+        at = int(time() if at is None else at)
+        rows = [
+            (fachportal, metric, at, value)
+            for fachportal, metrics in samples.items()
+            for metric, value in metrics.items()
+            if value is not None
+        ]
+        try:
+            with closing(self.connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)", rows)
+                conn.execute("DELETE FROM samples WHERE time < ?", (at - self.retention_days * DAY,))
+        except sqlite3.Error:
+            logger.exception(f"could not record the metrics history: {self.path}")
+            return
+        logger.info(f"recorded {len(rows)} metrics of {len(samples)} Fachportale")
+
+    def series(self, fachportal: str, since: float, metrics: list[str]) -> dict[str, list[tuple[int, float]]]:
+        """
+        Returns the (time, value) samples of the metrics since the given epoch seconds by metric, oldest first.
+        """
+        series: dict[str, list[tuple[int, float]]] = {}
+        try:
+            with closing(self.connect()) as conn:
+                rows = conn.execute(
+                    f"SELECT metric, time, value FROM samples WHERE fachportal = ? AND time >= ? "
+                    f"AND metric IN ({', '.join('?' * len(metrics))}) ORDER BY time",
+                    (fachportal, int(since), *metrics)).fetchall()
+        except sqlite3.Error:
+            logger.exception(f"could not read the metrics history: {self.path}")
+            return series
+        for metric, at, value in rows:
+            series.setdefault(metric, []).append((at, value))
+        return series
+
+    def values_at(self, at: float, fachportal: str = None) -> dict[str, dict[str, float]]:
+        """
+        Returns the metrics by Fachportal id of the latest sample at or before the given epoch seconds.
+
+        :param fachportal: only return the metrics of this Fachportal
+        """
+        values: dict[str, dict[str, float]] = {}
+        condition, params = ("AND fachportal = ?", (fachportal,)) if fachportal else ("", ())
+        try:
+            with closing(self.connect()) as conn:
+                rows = conn.execute(
+                    "SELECT samples.fachportal, metric, value FROM samples JOIN ("
+                    f"SELECT fachportal, MAX(time) AS time FROM samples WHERE time <= ? {condition} GROUP BY fachportal"
+                    ") AS latest ON samples.fachportal = latest.fachportal AND samples.time = latest.time",
+                    (int(at), *params)).fetchall()
+        except sqlite3.Error:
+            logger.exception(f"could not read the metrics history: {self.path}")
+            return values
+        for fachportal, metric, value in rows:
+            values.setdefault(fachportal, {})[metric] = value
+        return values
+
+
+def changes(current: dict[str, float], previous: dict[str, float]) -> dict[str, float]:
+    """
+    Returns the difference of each metric to its previous value, None if there is no previous value.
+    """
+    return {
+        metric: value - previous[metric] if value is not None and previous.get(metric) is not None else None
+        for metric, value in current.items()
+    }
@@ -0,0 +1,50 @@
+import hashlib
+import logging
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(data: Any) -> str:
+    """
+    Returns a hash of the repr of data, so data has to consist of types with a deterministic repr
+    (no sets, dicts are compared in insertion order).
+    """
+    return hashlib.sha1(repr(data).encode()).hexdigest()
+
+
+class RenderCache:
+    """
+    Keeps the last rendered layout or figure by key, together with the fingerprint of the data it was built from.
+    A value is only rebuilt if the fingerprint of its data changed.
+    """
+
+    def __init__(self) -> None:
+        # key -> (fingerprint, rendered value)
+        self.entries: dict[Hashable, tuple[str, Any]] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = Lock()
+
+    def get(self, key: Hashable, data: Any, build: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value of key if it was built from the same data, otherwise builds and caches it.
+        """
+        data_fingerprint = fingerprint(data)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == data_fingerprint:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        logger.info(f"rendering {key}")
+        value = build()
+        with self._lock:
+            self.entries[key] = (data_fingerprint, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,192 @@
+import logging
+import math
+import os
+import re
+import zlib
+from io import StringIO
+from threading import Lock
+from typing import TYPE_CHECKING, Any
+
+import dash_core_components as dcc
+import dash_html_components as html
+import dash_table
+from oeh_data_dashboard.oeh_elastic.shared_store import SharedStore
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TABLE_PAGE_SIZE = int(os.getenv("ADMIN_TABLE_PAGE_SIZE", 50))
+ADMIN_TABLE_SHARED_TTL = 24 * 3600  # seconds a table stays in the shared store
+
+# operators of the dash table filter query and the pandas operators they translate to
+FILTER_OPERATORS = {
+    "ge": "ge", ">=": "ge",
+    "le": "le", "<=": "le",
+    "lt": "lt", "<": "lt",
+    "gt": "gt", ">": "gt",
+    "ne": "ne", "!=": "ne",
+    "eq": "eq", "=": "eq",
+    "contains": "contains",
+    "datestartswith": "datestartswith",
+}
+FILTER_PART_PATTERN = re.compile(r"\s*\{(?P<column>[^}]*)\}\s+(?P<operator>\S+)\s*(?P<value>.*?)\s*$")
+
+
+def split_filter_part(filter_part: str) -> tuple[str, str, Any, str]:
+    """
+    Splits a part of a dash table filter query, e.g. '{doc_count} ge 10', into column, operator, value and the text
+    of the value. The value is a float if the text is an unquoted number.
+    Returns (None, None, None, None) if the part can not be parsed.
+    """
+    match = FILTER_PART_PATTERN.match(filter_part)
+    if match is None:
+        return None, None, None, None
+    operator = match["operator"]
+    # case sensitive (s) and insensitive (i) variants, e.g. icontains, are handled like the plain operators
+    if operator not in FILTER_OPERATORS and operator[:1] in ("i", "s"):
+        operator = operator[1:]
+    if operator not in FILTER_OPERATORS:
+        return None, None, None, None
+
+    value_part = match["value"]
+    if len(value_part) > 1 and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', "`"):
+        value = text = value_part[1:-1].replace("\\" + value_part[0], value_part[0])
+    else:
+        text = value_part
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+    return match["column"], FILTER_OPERATORS[operator], value, text
+
+
+def query_table(df: "pd.DataFrame", sort_by: list[dict] = None, filter_query: str = "") -> "pd.DataFrame":
+    """
+    Returns the rows of df matching the filter query of a dash table, sorted by its sort_by.
+    """
+    from pandas.api.types import is_string_dtype
+
+    for filter_part in (filter_query or "").split(" && "):
+        column, operator, value, text = split_filter_part(filter_part)
+        if column not in df.columns:
+            continue
+        if operator in ("eq", "ne", "lt", "le", "gt", "ge") and is_string_dtype(df[column]):
+            # e.g. the key "10" of a terms aggregation, not the number parsed from the filter
+            df = df.loc[getattr(df[column].astype(str), operator)(text)]
+        elif operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+            try:
+                df = df.loc[getattr(df[column], operator)(value)]
+            except TypeError:
+                # compare as strings if the column does not match the type of the value
+                df = df.loc[getattr(df[column].astype(str), operator)(text)]
+        elif operator == "contains":
+            df = df.loc[df[column].astype(str).str.contains(text, case=False, regex=False)]
+        elif operator == "datestartswith":
+            df = df.loc[df[column].astype(str).str.startswith(text)]
+
+    sort_by = [col for col in sort_by or [] if col["column_id"] in df.columns]
+    if sort_by:
+        df = df.sort_values(
+            [col["column_id"] for col in sort_by],
+            ascending=[col["direction"] == "asc" for col in sort_by],
+            kind="mergesort"
+        )
+    return df
+
+
+class ServerSideTables:
+    """
+    Holds the DataFrames of dash tables on the server, so only the visible page is sent to the browser.
+    The tables are addressed by the index of their pattern-matching id {"type": "server-side-table", "index": ...}.
+    With a shared store, the tables are also written to it, so any worker can serve the pages of a table.
+    """
+
+    def __init__(self, page_size: int = ADMIN_TABLE_PAGE_SIZE, shared: SharedStore = None) -> None:
+        self.page_size = page_size
+        self.shared = shared
+        self.tables: dict[str, "pd.DataFrame"] = {}
+        self._lock = Lock()
+
+    def build_data_table(self, table_id: str, df: "pd.DataFrame", export: bool = False, **kwargs) -> html.Div:
+        """
+        Stores df and returns a dash table with custom paging, sorting and filtering showing its first page.
+
+        :param export: add a button to download the whole filtered and sorted table as csv
+        """
+        with self._lock:
+            self.tables[table_id] = df
+        if self.shared is not None:
+            self.shared.set(
+                f"table:{table_id}", zlib.compress(df.to_json(orient="split").encode()), ttl=ADMIN_TABLE_SHARED_TTL)
+        data, page_count = self.get_page(table_id, 0, self.page_size)
+        data_table = dash_table.DataTable(
+            id={"type": "server-side-table", "index": table_id},
+            columns=[{"name": i, "id": i} for i in df.columns],
+            data=data,
+            page_current=0,
+            page_size=self.page_size,
+            page_count=page_count,
+            page_action="custom",
+            sort_action="custom",
+            sort_mode="single",
+            sort_by=[],
+            filter_action="custom",
+            filter_query="",
+            **kwargs
+        )
+        if not export:
+            return html.Div(data_table)
+        return html.Div(children=[
+            html.Button(
+                "Export (CSV)",
+                id={"type": "server-side-table-export", "index": table_id},
+                className="load-more-btn"
+            ),
+            dcc.Download(id={"type": "server-side-table-download", "index": table_id}),
+            data_table
+        ])
+
+    def get_table(self, table_id: str, sort_by: list[dict] = None, filter_query: str = "") -> "pd.DataFrame":
+        """
+        Returns the filtered and sorted table.
+        Raises a KeyError if there is no table with table_id.
+        """
+        with self._lock:
+            df = self.tables.get(table_id)
+        if df is None:
+            df = self.get_shared_table(table_id)
+        return query_table(df, sort_by, filter_query)
+
+    def get_shared_table(self, table_id: str) -> "pd.DataFrame":
+        """
+        Returns the table built by another worker from the shared store.
+        Raises a KeyError if it is not there.
+        """
+        data = self.shared.get(f"table:{table_id}") if self.shared is not None else None
+        if data is None:
+            raise KeyError(table_id)
+        import pandas as pd
+
+        df = pd.read_json(StringIO(zlib.decompress(data).decode()), orient="split")
+        with self._lock:
+            self.tables[table_id] = df
+        return df
+
+    def get_page(
+        self,
+        table_id: str,
+        page_current: int,
+        page_size: int,
+        sort_by: list[dict] = None,
+        filter_query: str = ""
+    ) -> tuple[list[dict], int]:
+        """
+        Returns the records of the requested page and the number of pages of the filtered table.
+        Raises a KeyError if there is no table with table_id.
+        """
+        df = self.get_table(table_id, sort_by, filter_query)
+        page_count = max(1, math.ceil(len(df) / page_size))
+        start = page_current * page_size
+        return df.iloc[start:start + page_size].to_dict("records"), page_count
@@ -1,7 +1,9 @@
-from collections import Counter
+import sys
+from collections import defaultdict
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
-from typing import TypedDict, Literal
+from datetime import datetime, timedelta, timezone
+from time import time
+from typing import Iterable, TypedDict, Literal
 
 from oeh_data_dashboard.constants import (ES_COLLECTION_URL, ES_NODE_URL,
                                           ES_PREVIEW_URL)
@@ -81,17 +83,77 @@ class MissingInfo:
 
 
 @dataclass
+class MissingInfoPage:
+    items: list[MissingInfo] = field(default_factory=list)
+    total: int = 0  # total number of missing infos, not only the ones of this page
+    search_after: list = None  # sort values of the last item, None if there is no further page
+
+
+def format_timestamp(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+# fps tuples shared by all materials in the same Fachportale
+_fps_tuples: dict[tuple, tuple] = {}
+
+
+def intern_fps(fps) -> tuple:
+    fps = tuple(sorted(fps or ()))
+    return _fps_tuples.setdefault(fps, fps)
+
+
 class SearchedMaterialInfo:
-    _id: str = ""
-    search_strings: Counter = field(default_factory=Counter)
-    clicks: int = 0
-    name: str = ""
-    title: str = ""
-    content_url: str = ""
-    crawler: str = ""
-    creator: str = ""
-    timestamp: str = ""  # timestamp of last access on material (utc)
-    fps: set = field(default_factory=set)
+    """
+    A clicked material with its clicks and search strings.
+    There is one instance per clicked material, so it is kept compact:
+    no instance dict, interned strings and the last click as epoch seconds.
+    """
+    __slots__ = (
+        "_id", "search_strings", "clicks", "name", "title", "content_url", "crawler", "creator", "last_click", "fps")
+
+    def __init__(
+        self,
+        _id: str = "",
+        search_strings: dict[str, int] = None,
+        clicks: int = 0,
+        name: str = "",
+        title: str = "",
+        content_url: str = "",
+        crawler: str = "",
+        creator: str = "",
+        last_click: float = 0.0,  # epoch seconds of the last click on the material
+        fps: Iterable[str] = ()
+    ):
+        self._id = _id
+        # search string -> number of clicks after searching for it
+        self.search_strings: dict[str, int] = {
+            sys.intern(term): count for term, count in (search_strings or {}).items()}
+        self.clicks = clicks
+        self.name = name
+        self.title = title
+        self.content_url = content_url
+        self.crawler = sys.intern(crawler) if crawler else crawler
+        self.creator = sys.intern(creator) if creator else creator
+        self.last_click = last_click
+        self.fps: tuple[str, ...] = intern_fps(fps)
+
+    @property
+    def timestamp(self) -> str:
+        """
+        Timestamp of the last click on the material (utc).
+        """
+        return format_timestamp(self.last_click) if self.last_click else ""
+
+    def add_clicks(self, clicks: int, last_click: float, search_strings: dict[str, int]):
+        """
+        :param last_click: epoch seconds of the last of the clicks
+        :param search_strings: number of the clicks by search string
+        """
+        self.clicks += clicks
+        self.last_click = max(last_click, self.last_click)
+        for search_string, count in search_strings.items():
+            search_string = sys.intern(search_string)
+            self.search_strings[search_string] = self.search_strings.get(search_string, 0) + count
 
     def __repr__(self) -> str:
         return self._id
@@ -103,7 +165,7 @@ class SearchedMaterialInfo:
             return False
 
     def __lt__(self, o: object):
-        return self.timestamp < o.timestamp
+        return self.last_click < o.last_click
 
     def __hash__(self) -> int:
         return hash((self._id,))
@@ -112,18 +174,150 @@ class SearchedMaterialInfo:
         search_term_count = "\"{}\"({})"  # term, count
         return {
             "id": self._id,
-            "search_strings": ", ".join([search_term_count.format(term, count) for term, count in self.search_strings.items()]),
+            "search_strings": ", ".join([search_term_count.format(term, count) for term, count in list(self.search_strings.items())]),
             "clicks": self.clicks,
             "name": self.name,
             "title": self.title,
             "crawler": self.crawler,
             "creator": self.creator,
             "timestamp": self.timestamp,
-            "local_timestamp": (datetime.fromisoformat(self.timestamp[:-1]) + timedelta(hours=2)).strftime("%Y-%m-%d %H:%M:%S"),
+            "local_timestamp": (datetime.utcfromtimestamp(self.last_click) + timedelta(hours=2)).strftime("%Y-%m-%d %H:%M:%S"),
             "thumbnail_url": ES_PREVIEW_URL.format(self._id)
         }
 
 
+class DayBuckets:
+    """
+    Counts by key in daily buckets for the last `days` days, e.g. the clicks by material id.
+    The buckets form a ring, so moving on to a new day only replaces the oldest bucket.
+    A window of up to `days` days is counted by summing at most that many buckets.
+    """
+
+    def __init__(self, days: int):
+        self.days = days
+        self.buckets: list[dict[str, int]] = [{} for _ in range(days)]
+        self.current_day: int = None  # epoch day of the newest bucket
+
+    @staticmethod
+    def day_of(epoch: float) -> int:
+        return int(epoch // (24 * 3600))
+
+    def advance(self, day: int):
+        """
+        Makes day the newest bucket, emptying the buckets of the days that fall out of the ring.
+        """
+        if self.current_day is None:
+            self.current_day = day
+            return
+        if day <= self.current_day:
+            return
+        for expired_day in range(self.current_day + 1, min(day, self.current_day + self.days) + 1):
+            self.buckets[expired_day % self.days] = {}
+        self.current_day = day
+
+    def add(self, key: str, epoch: float, amount: int = 1):
+        day = self.day_of(epoch)
+        self.advance(day)
+        if self.current_day - day >= self.days:
+            return
+        bucket = self.buckets[day % self.days]
+        bucket[key] = bucket.get(key, 0) + amount
+
+    def window(self, days: int, now: float = None) -> list[dict[str, int]]:
+        """
+        Returns the buckets of the last days days up to now (default: the current time), newest first.
+        """
+        today = self.day_of(time() if now is None else now)
+        self.advance(today)
+        first_day = max(today - min(days, self.days) + 1, self.current_day - self.days + 1)
+        return [self.buckets[day % self.days] for day in range(today, first_day - 1, -1)]
+
+    def count(self, key: str, days: int, now: float = None) -> int:
+        return sum(bucket.get(key, 0) for bucket in self.window(days, now))
+
+    def totals(self, days: int, now: float = None) -> dict[str, int]:
+        totals: dict[str, int] = {}
+        for bucket in self.window(days, now):
+            # copied, the ingest may add to the newest bucket meanwhile
+            for key, count in list(bucket.items()):
+                totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def to_rows(self) -> list[tuple[int, str, int]]:
+        """
+        Returns (epoch day, key, count) of all counts, to save them.
+        """
+        if self.current_day is None:
+            return []
+        return [
+            (day, key, count)
+            for day in range(self.current_day - self.days + 1, self.current_day + 1)
+            for key, count in list(self.buckets[day % self.days].items())
+        ]
+
+    @classmethod
+    def from_rows(cls, days: int, rows: Iterable[tuple[int, str, int]]) -> "DayBuckets":
+        day_buckets = cls(days)
+        for day, key, count in sorted(rows):
+            day_buckets.add(sys.intern(key), day * 24 * 3600, count)
+        return day_buckets
+
+
+class CollectionTree:
+    """
+    In-memory index of the collection tree with the number of documents directly in each collection
+    and in each collection including all of its subcollections.
+    """
+
+    def __init__(
+        self,
+        collections: dict[str, tuple[str, list[str]]],
+        doc_counts: dict[str, int],
+        subtree_counts: dict[str, int] = None
+    ):
+        """
+        :param collections: dict with collection ids as keys and (title, path) tuples as values,
+            path being the ids of all ancestors of the collection
+        :param doc_counts: number of documents directly in a collection by collection id
+        :param subtree_counts: number of distinct documents in a collection or any of its subcollections
+            by collection id. If not given, they are rolled up from doc_counts,
+            which counts a document in several subcollections once per subcollection.
+        """
+        self.titles: dict[str, str] = {_id: title for _id, (title, path) in collections.items()}
+        self.direct_counts: dict[str, int] = {_id: doc_counts.get(_id, 0) for _id in collections}
+        # ids of all collections below a collection
+        self.descendants: dict[str, list[str]] = defaultdict(list)
+
+        parents: dict[str, str] = {}
+        for _id, (title, path) in collections.items():
+            for ancestor in path:
+                self.descendants[ancestor].append(_id)
+            parents[_id] = next((ancestor for ancestor in reversed(path) if ancestor in collections), None)
+
+        if subtree_counts is not None:
+            self.subtree_counts: dict[str, int] = {_id: subtree_counts.get(_id, 0) for _id in collections}
+            return
+        self.subtree_counts = dict(self.direct_counts)
+        # roll up the counts bottom-up, deepest collections first
+        for _id in sorted(collections, key=lambda _id: len(collections[_id][1]), reverse=True):
+            if parents[_id]:
+                self.subtree_counts[parents[_id]] += self.subtree_counts[_id]
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def empty_collections(self, collection_id: str, doc_threshold: int = 0) -> set[MissingInfo]:
+        """
+        Returns the collections below a collection that contain no more than doc_threshold documents,
+        neither directly nor in their subcollections.
+        """
+        return {
+            MissingInfo(_id=_id, title=self.titles[_id], doc_count=self.direct_counts[_id], _type="ccm:map")
+            for _id in self.descendants.get(collection_id, [])
+            if self.subtree_counts[_id] <= doc_threshold
+        }
+
+
 @dataclass
 class QueryParams:
     attribute: str = None  # attribute to query
@@ -1,25 +1,38 @@
+import os
+from threading import Lock
+from time import monotonic
+
 from .attributes import Attribute
 
 import dash_html_components as html
 import dash_core_components as dcc
 
-import plotly.express as px
-
 
 from oeh_data_dashboard.index_info.attributes import relevant_attributes
 from oeh_data_dashboard.oeh_elastic import oeh
 
+ATTRIBUTE_DISTRIBUTION_REFRESH_INTERVAL = int(os.getenv("ATTRIBUTE_DISTRIBUTION_REFRESH_INTERVAL", 3600))  # seconds
+
 
 # get missing + aggregations
 def build_attribute_df(attributes: list[Attribute]):
+    import pandas as pd
+
+    # top ten, other and missing buckets of all attributes from one query
+    buckets_by_attribute = oeh.get_attribute_distribution(
+        [attribute.es_property for attribute in attributes], size=10)
+    # build one dataframe for all attributes and split it by attribute
+    df = pd.DataFrame(
+        [
+            {"attribute": attribute, **bucket.as_dict()}
+            for attribute, buckets in buckets_by_attribute.items()
+            for bucket in buckets
+        ],
+        columns=["attribute", "key", "doc_count"]
+    )
+    dfs = {attribute: group.drop(columns="attribute").reset_index(drop=True) for attribute, group in df.groupby("attribute", sort=False)}
     for attribute in attributes:
-        missing_agg = oeh.get_aggregations(attribute.es_property, agg_type="missing")
-        missing_bucket = oeh.get_doc_count_from_missing_agg(missing_agg)
-        top_ten_and_other_agg = oeh.get_aggregations(attribute.es_property, size=10)
-        top_ten_and_other_buckets = oeh.build_buckets_from_agg(top_ten_and_other_agg, include_other=True)
-        buckets = [*top_ten_and_other_buckets, missing_bucket]
-        # build a dataframe
-        attribute.df = oeh.build_df_from_buckets(buckets)
+        attribute.df = dfs[attribute.es_property]
 
         # build layout
         attribute.graph = build_graph_from_df(attribute)
@@ -27,6 +40,8 @@ def build_attribute_df(attributes: list[Attribute]):
 
 
 def build_graph_from_df(attribute: Attribute):
+    import plotly.express as px
+
     fig = px.bar(attribute.df, x="key", y="doc_count")
     fig.update_layout(
         title = f"Attribut: {attribute.name} ({attribute.es_property})"
@@ -42,6 +57,19 @@ def build_layout(attributes: list[Attribute]):
     return layout
 
 
-attributes = build_attribute_df(relevant_attributes)
-layout = build_layout(relevant_attributes)
+_layout: list = None
+_built_at: float = None
+_lock = Lock()
+
 
+def get_layout() -> list:
+    """
+    Returns the layout of the attribute distribution.
+    It is built on first use and rebuilt once it is older than ATTRIBUTE_DISTRIBUTION_REFRESH_INTERVAL seconds.
+    """
+    global _layout, _built_at
+    with _lock:
+        if _layout is None or monotonic() - _built_at >= ATTRIBUTE_DISTRIBUTION_REFRESH_INTERVAL:
+            _layout = build_layout(build_attribute_df(relevant_attributes))
+            _built_at = monotonic()
+        return _layout
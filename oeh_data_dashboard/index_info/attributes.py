@@ -1,13 +1,16 @@
 from dataclasses import dataclass
-import pandas as pd
+from typing import TYPE_CHECKING
 import dash_core_components as dcc
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 @dataclass
 class Attribute:
     name: str
     es_property: str
-    df: pd.DataFrame = None
+    df: "pd.DataFrame" = None
     graph: dcc.Graph = None
 
 
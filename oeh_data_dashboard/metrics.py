@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import functools
+import sys
+from bisect import bisect_left
+from contextlib import contextmanager
+from math import inf
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Generator
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, inf)  # seconds
+SIZE_BUCKETS = (1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, inf)  # bytes
+LABEL_NAMES = ("method", "index")
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonically increasing count by label values.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = LABEL_NAMES) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> Generator[str, None, None]:
+        with self._lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            labels = dict(zip(self.label_names, label_values))
+            yield f"{self.name}{format_labels(labels)} {format_value(value)}"
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets by label values.
+    """
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple = LATENCY_BUCKETS,
+        label_names: tuple = LABEL_NAMES
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.label_names = label_names
+        # label values -> (count per bucket, sum)
+        self.values: dict[tuple, tuple[list[int], float]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            counts, total = self.values.get(label_values, (None, 0.0))
+            if counts is None:
+                counts = [0] * len(self.buckets)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[label_values] = (counts, total + value)
+
+    def samples(self) -> Generator[str, None, None]:
+        with self._lock:
+            values = [(label_values, list(counts), total) for label_values, (counts, total) in self.values.items()]
+        for label_values, counts, total in values:
+            labels = dict(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = format_labels({**labels, "le": format_value(bound)})
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(labels)} {format_value(total)}"
+            yield f"{self.name}_count{format_labels(labels)} {cumulative}"
+
+
+class Registry:
+    """
+    Collection of metrics that are rendered in the Prometheus text format.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CALLS = REGISTRY.register(Counter(
+    "oeh_dashboard_calls_total", "Number of calls to elastic, edu-sharing and dash callbacks"))
+ERRORS = REGISTRY.register(Counter(
+    "oeh_dashboard_errors_total", "Number of calls that raised an exception"))
+LATENCY = REGISTRY.register(Histogram(
+    "oeh_dashboard_latency_seconds", "Duration of the calls in seconds"))
+RESPONSE_SIZE = REGISTRY.register(Histogram(
+    "oeh_dashboard_response_size_bytes", "Size of the responses in bytes", buckets=SIZE_BUCKETS))
+
+
+def caller_name(depth: int = 2) -> str:
+    """
+    Returns the name of the function that called the function calling this one.
+    """
+    return sys._getframe(depth).f_code.co_name
+
+
+@contextmanager
+def track(method: str, index: str = "", ignore: tuple = ()) -> Generator[None, None, None]:
+    """
+    Counts the call and measures its duration, exceptions other than ignore are counted as errors.
+    """
+    CALLS.inc(method, index)
+    start = perf_counter()
+    try:
+        yield
+    except ignore:
+        raise
+    except Exception:
+        ERRORS.inc(method, index)
+        raise
+    finally:
+        LATENCY.observe(perf_counter() - start, method, index)
+
+
+def observe_size(size: int, method: str, index: str = ""):
+    RESPONSE_SIZE.observe(size, method, index)
+
+
+def tracked(method: str = None, index: str = "", ignore: tuple = ()) -> Callable:
+    """
+    Decorator that tracks every call of the function, labelled by method (default: the function name) and index.
+    """
+    def decorator(func: Callable) -> Callable:
+        name = method or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(name, index, ignore=ignore):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1 +1,2 @@
-from .oeh_elastic import oeh, EduSharing
+from .oeh_elastic import oeh, AnalyticsRefresher, EduSharing
+from .resilience import ServiceUnavailableError, collect_stale_results
@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 
+import json
 import logging
 import os
-from collections import Counter, defaultdict
-from time import sleep
-from typing import Generator, Literal
+import sys
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from itertools import islice
+from threading import BoundedSemaphore, Event, Lock, Thread, local
+from math import inf
+from time import monotonic, time
+from typing import TYPE_CHECKING, Any, Callable, Generator, Hashable, Iterable, Literal
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from elasticsearch import Elasticsearch
-from elasticsearch.exceptions import ConnectionError
-from oeh_data_dashboard.helper_classes import Bucket, MissingInfo, SearchedMaterialInfo
-from numpy import inf
-
-import pandas as pd
+from elasticsearch.exceptions import ConnectionError, TransportError
+from oeh_data_dashboard import metrics
+from oeh_data_dashboard.helper_classes import Bucket, CollectionTree, DayBuckets, MissingInfo, SearchedMaterialInfo
+from oeh_data_dashboard.oeh_elastic.query_cache import QueryCache
+from oeh_data_dashboard.oeh_elastic.resilience import CircuitBreaker, RetryPolicy, ServiceUnavailableError, mark_stale
+from oeh_data_dashboard.oeh_elastic.shared_store import SharedStore, open_shared_store
+from oeh_data_dashboard.oeh_elastic.snapshot import (ANALYTICS_SNAPSHOT_PATH, AnalyticsSnapshot, dump_analytics,
+                                                     load_analytics)
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 load_dotenv()
 
@@ -21,9 +35,9 @@ logger = logging.getLogger(__name__)
 
 
 def set_conn_retries():
-    MAX_CONN_RETRIES = os.getenv("MAX_CONN_RETRIES", float(inf))
+    MAX_CONN_RETRIES = os.getenv("MAX_CONN_RETRIES", inf)
     if MAX_CONN_RETRIES == "inf":
-        return float(inf)
+        return inf
     else:
         if type(eval(MAX_CONN_RETRIES)) == int:
             return eval(MAX_CONN_RETRIES)
@@ -42,64 +56,281 @@ SOURCE_FIELDS = [
     "properties.ccm:wwwurl",
     "properties.cm:name"
 ]
-ANALYTICS_INITIAL_COUNT = eval(os.getenv("ANALYTICS_INITIAL_COUNT", 10000))
+# source fields of the infos about the clicked materials
+RESOURCE_INFO_FIELDS = [
+    "nodeRef.id",
+    "properties.cclom:title",
+    "properties.cm:name",
+    "properties.ccm:wwwurl",
+    "collections.path",
+    "properties.ccm:replicationsource",
+    "properties.cm:creator"
+]
+# maximum number of resources to get infos about with a single terms query
+RESOURCE_INFO_CHUNK_SIZE = 1000
+# number of missing infos loaded per page and the stable sort key to page through them with search_after
+MISSING_INFO_PAGE_SIZE = 50
+PAGINATION_SORT = [{"nodeRef.id.keyword": "asc"}]
+ES_COLLECTIONS_URL = "https://redaktion.openeduhub.net/edu-sharing/rest/collection/v1/collections/local/5e40e372-735c-4b17-bbf7-e827a5702b57/children/collections"
+EDU_SHARING_PAGE_SIZE = 100
+EDU_SHARING_CACHE_TTL = int(os.getenv("EDU_SHARING_CACHE_TTL", 3600))  # seconds
+# maximum number of search analytics events ingested at startup
+ANALYTICS_INITIAL_COUNT = float(os.getenv("ANALYTICS_INITIAL_COUNT", inf))
+ANALYTICS_PAGE_SIZE = 1000  # number of search analytics events fetched at once
+# number of search analytics events processed at once, the clicks of a batch are counted together
+ANALYTICS_BATCH_SIZE = 10000
+# ids of the collections a document is in and of all their ancestors, each of them once
+SUBTREE_IDS_SCRIPT = (
+    "def ids = new HashSet(doc['collections.path.keyword']); "
+    "ids.addAll(doc['collections.nodeRef.id.keyword']); "
+    "return new ArrayList(ids);"
+)
+# number of buckets of a composite aggregation fetched at once, also the rows of a DataFrame chunk
+AGGREGATION_PAGE_SIZE = int(os.getenv("AGGREGATION_PAGE_SIZE", 1000))
+POINT_IN_TIME_KEEP_ALIVE = "1m"
+# status codes of elastic responses that count as a failure of the cluster for the circuit breaker
+SERVICE_ERROR_STATUS_CODES = (429, 502, 503, 504)
+# maximum number of concurrent requests to elastic, e.g. for the admin overview
+ES_CONCURRENCY = int(os.getenv("ES_CONCURRENCY", 8))
+# held during each request to elastic, so all threads of the process together send at most ES_CONCURRENCY at a time
+ES_SLOTS = BoundedSemaphore(ES_CONCURRENCY)
+# set in the threads of EXECUTOR
+_pool_thread = local()
+
+
+def _mark_pool_thread():
+    _pool_thread.active = True
+
+
+# runs the concurrent calls of OEHElastic.submit for all callers, no threads are started before the first call
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=ES_CONCURRENCY, thread_name_prefix="oeh-elastic", initializer=_mark_pool_thread)
+ANALYTICS_REFRESH_INTERVAL = int(os.getenv("ANALYTICS_REFRESH_INTERVAL", 300))  # seconds
+# materials whose last click is older are evicted from the search analytics
+ANALYTICS_WINDOW_DAYS = int(os.getenv("ANALYTICS_WINDOW_DAYS", 30))
+# windows in days the searched materials can be shown for
+ANALYTICS_WINDOW_OPTIONS = sorted({days for days in (1, 7, ANALYTICS_WINDOW_DAYS) if days <= ANALYTICS_WINDOW_DAYS})
 
 
 class EduSharing:
-    connection_retries: int = 0
+    """
+    Client for the edu-sharing repository with pooled keep-alive connections.
+    The Fachportal collections are fetched page by page and cached for EDU_SHARING_CACHE_TTL seconds,
+    after that each page is revalidated with its ETag.
+    """
+    session = requests.Session()
+    session.headers.update({"Accept": "application/json"})
+    session.mount("https://", HTTPAdapter(pool_maxsize=ES_CONCURRENCY))
+    circuit_breaker = CircuitBreaker("edu-sharing")
+    retry_policy = RetryPolicy(max_retries=MAX_CONN_RETRIES, retry_on=(requests.RequestException, ValueError))
+    # last successfully fetched collections, also served if edu-sharing is not reachable
+    last_collections: list = None
+    last_fetched: float = None
+    # skipCount -> (ETag, response) of the fetched pages
+    pages: dict[int, tuple[str, dict]] = {}
+    _lock = Lock()
 
     @classmethod
-    def get_collections(cls):
-        ES_COLLECTIONS_URL = "https://redaktion.openeduhub.net/edu-sharing/rest/collection/v1/collections/local/5e40e372-735c-4b17-bbf7-e827a5702b57/children/collections?scope=TYPE_EDITORIAL&skipCount=0&maxItems=1247483647&sortProperties=cm%3Acreated&sortAscending=true&"
+    @metrics.tracked(index="edu-sharing")
+    def get_collections(cls) -> list:
+        """
+        Returns the Fachportal collections, cached for EDU_SHARING_CACHE_TTL seconds.
+        """
+        with cls._lock:
+            if cls.last_collections is not None and monotonic() - cls.last_fetched < EDU_SHARING_CACHE_TTL:
+                return cls.last_collections
+
+            logger.info(f"Collecting Collections from edu-sharing...")
+            try:
+                cls.last_collections = cls.retry_policy.call(
+                    lambda: list(cls.iter_collections()), cls.circuit_breaker)
+                cls.last_fetched = monotonic()
+            except ServiceUnavailableError:
+                if cls.last_collections is None:
+                    raise
+                logger.warning("edu-sharing is not reachable, serving the last fetched collections")
+                mark_stale("edu-sharing")
+            return cls.last_collections
 
-        headers = {
-            "Accept": "application/json"
-        }
+    @classmethod
+    def iter_collections(cls) -> Generator[dict, None, None]:
+        """
+        Yields the Fachportal collections, fetching them page by page.
+        """
+        skip_count = 0
+        while True:
+            page: dict = cls.get_collections_page(skip_count)
+            collections: list = page.get("collections", [])
+            yield from collections
+            skip_count += len(collections)
+            total = page.get("pagination", {}).get("total", 0)
+            if not collections or skip_count >= total:
+                return
 
+    @classmethod
+    @metrics.tracked(index="edu-sharing", ignore=(requests.HTTPError,))
+    def get_collections_page(cls, skip_count: int) -> dict:
         params = {
             "scope": "TYPE_EDITORIAL",
-            "skipCount": "0",
-            "maxItems": "1247483647",
-            "sortProperties": "cm%3Acreated",
+            "skipCount": skip_count,
+            "maxItems": EDU_SHARING_PAGE_SIZE,
+            "sortProperties": "cm:created",
             "sortAscending": "true"
         }
-
-        logger.info(f"Collecting Collections from edu-sharing...")
-
-        try:
-            r_collections: list = requests.get(
-                ES_COLLECTIONS_URL,
-                headers=headers,
-                params=params
-            ).json().get("collections")
-            cls.connection_retries = 0
-            return r_collections
-
-        except:
-            if cls.connection_retries < MAX_CONN_RETRIES:
-                cls.connection_retries += 1
-                logger.error(
-                    f"Connection error trying to reach edu-sharing repository, trying again in 30 seconds. Retries: {cls.connection_retries}")
-                sleep(30)
-                return EduSharing.get_collections()
+        etag, cached_page = cls.pages.get(skip_count, (None, None))
+        headers = {"If-None-Match": etag} if etag else {}
+
+        r = cls.session.get(ES_COLLECTIONS_URL, params=params, headers=headers, timeout=30)
+        metrics.observe_size(len(r.content), "get_collections_page", "edu-sharing")
+        if r.status_code == 304 and cached_page is not None:
+            return cached_page
+        r.raise_for_status()
+        page: dict = r.json()
+        if r.headers.get("ETag"):
+            cls.pages[skip_count] = (r.headers["ETag"], page)
+        return page
+
+
+def prefetch(iterator: Iterable) -> Generator:
+    """
+    Yields the items of iterator while the next item is already fetched in a background thread.
+    """
+    iterator = iter(iterator)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") as executor:
+        future = executor.submit(next, iterator, None)
+        while True:
+            item = future.result()
+            if item is None:
+                return
+            future = executor.submit(next, iterator, None)
+            yield item
+
+
+def concat_pages(pages: Iterable[list], min_size: int) -> Generator[list, None, None]:
+    """
+    Yields the items of consecutive pages joined to batches of at least min_size items, the last one may be smaller.
+    """
+    batch = []
+    for page in pages:
+        batch.extend(page)
+        if len(batch) >= min_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def is_service_error(e: Exception) -> bool:
+    """
+    Returns True for responses of an overloaded or unavailable cluster, as opposed to errors of the query.
+    """
+    return isinstance(e, TransportError) and e.status_code in SERVICE_ERROR_STATUS_CODES
+
+
+class AnalyticsRefresher(Thread):
+    """
+    Daemon thread that calls a refresh function in a fixed interval,
+    so page callbacks only have to read the latest search analytics.
+    An optional warm_up function is called once before the first refresh, warmed_up is set after it.
+    """
+
+    def __init__(
+        self,
+        refresh: Callable[[], None],
+        interval: int = ANALYTICS_REFRESH_INTERVAL,
+        warm_up: Callable[[], None] = None,
+        name: str = "analytics-refresher"
+    ) -> None:
+        super().__init__(name=name, daemon=True)
+        self.refresh = refresh
+        self.interval = interval
+        self.warm_up = warm_up
+        self.warmed_up = Event()
+        self._stopped = Event()
+
+    def run(self):
+        if self.warm_up is not None:
+            try:
+                self.warm_up()
+            except Exception:
+                logger.exception("Warming up failed")
+        self.warmed_up.set()
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception(f"Refreshing failed: {self.name}")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
 
 
 class OEHElastic:
     es: Elasticsearch
 
-    def __init__(self, hosts=None) -> None:
+    def __init__(
+        self,
+        hosts=None,
+        cache: QueryCache = None,
+        use_cache: bool = True,
+        shared_store: SharedStore = None
+    ) -> None:
+        """
+        :param cache: cache for the es-query-results, a default QueryCache if not given
+        :param use_cache: set to False to disable caching
+        :param shared_store: store shared with the other workers, opened from SHARED_STORE_URL if not given
+        """
         if hosts is None:
             hosts = [os.getenv("ES_HOST", "localhost")]
-        self.connection_retries = 0
-        self.es = Elasticsearch(hosts=hosts)
-        self.last_timestamp = "now-30d"  # get values for last 30 days by default
-        # dict with collections as keys and a list of Searched Material Info as values
-        self.searched_materials_by_collection: dict[str, SearchedMaterialInfo] = {}
-        self.all_searched_materials: set[SearchedMaterialInfo] = set()
-
+        self.circuit_breaker = CircuitBreaker("elastic")
+        self.retry_policy = RetryPolicy(
+            max_retries=MAX_CONN_RETRIES, retry_on=(ConnectionError,), is_failure=is_service_error)
+        # keep enough pooled connections for concurrent requests
+        self.es = Elasticsearch(hosts=hosts, maxsize=ES_CONCURRENCY)
+        # only the leader among the workers sharing the store ingests the search analytics, the others load them
+        self.shared_store: SharedStore = open_shared_store() if shared_store is None else shared_store
+        self.cache: QueryCache = None
+        if use_cache:
+            self.cache = QueryCache(shared=self.shared_store) if cache is None else cache
+        # get values for the last ANALYTICS_WINDOW_DAYS days by default
+        self.last_timestamp = f"now-{ANALYTICS_WINDOW_DAYS}d"
+        # dict with collections as keys and a list of Searched Material Info as values (last clicked first)
+        self.searched_materials_by_collection: dict[str, list[SearchedMaterialInfo]] = {}
+        # dicts with material ids as keys, ordered by last click (last clicked last)
+        self.all_searched_materials: dict[str, SearchedMaterialInfo] = {}
+        self.materials_by_collection: dict[str, dict[str, SearchedMaterialInfo]] = {}
+        # clicks by material id and by search string per day, to count them for any window
+        self.clicks_by_day = DayBuckets(ANALYTICS_WINDOW_DAYS)
+        self.search_strings_by_day = DayBuckets(ANALYTICS_WINDOW_DAYS)
+        # index of all collections, built on first use and on every refresh
+        self.collection_tree: CollectionTree = None
+        # held while the search analytics are refreshed, so concurrent refreshes are skipped
+        self.analytics_lock = Lock()
+        # snapshot of the search analytics on disk, to only ingest new events after a restart
+        self.snapshot: AnalyticsSnapshot = AnalyticsSnapshot(ANALYTICS_SNAPSHOT_PATH) if ANALYTICS_SNAPSHOT_PATH else None
+
+    def warm_up(self):
+        """
+        Restores the search analytics from the snapshot and ingests the initial events.
+        Nothing is queried when the client is created, so this has to be called once before serving.
+        Workers that are not the leader only load the search analytics published by the leader.
+        """
+        if not self.is_leader():
+            self.load_shared_analytics()
+            return
+        self.load_snapshot()
+        # a new leader continues from the analytics of its predecessor
+        self.load_shared_analytics(newer_only=True)
         self.get_oeh_search_analytics(
             timestamp=None, count=ANALYTICS_INITIAL_COUNT)
 
+    def is_leader(self) -> bool:
+        """
+        Returns True if this worker ingests the search analytics, always without a shared store.
+        """
+        return self.shared_store is None or self.shared_store.try_acquire_leadership()
+
     def collections_by_fachportale(
         self,
         fachportal_key: str = None,
@@ -109,91 +340,199 @@ class OEHElastic:
         """
         Returns a dict of Fachportal-IDs as keys and a list of collection ids as values
         if there is no material present in that collection (or less than the threshold value).
+        The collections are looked up in the collection tree, so no es-queries are needed.
 
         :param fachportal_key: ID of the Fachportal
         :param doc_threshold: Threshold of documents to be at least in a collection
         """
         logger.info(f"getting collections with threshold of {doc_threshold} and key: {fachportal_key}")
+        collection_tree = self.get_collection_tree()
 
-        def check_for_resources_in_subcollection(collection_id: str):
-            body = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "terms": {
-                                    "type": [
-                                        "ccm:io"
-                                    ]
-                                }
-                            },
-                            {
-                                "bool": {
-                                    "should": [
-                                        {
-                                            "match": {
-                                                "path": collection_id
-                                            }
-                                        }
-                                    ]
-                                }
-                            }
-                        ]
-                    }
-                },
-                "_source": ""
+        if fachportal_key:
+            return collection_tree.empty_collections(fachportal_key, doc_threshold)
+        else:
+            present_collections: dict[str, set[MissingInfo]] = {
+                key: collection_tree.empty_collections(key, doc_threshold) for key in collection_ids
             }
-            r = self.query_elastic(body=body, index="workspace")
-            total_hits = r.get("hits").get("total").get("value")
+            return dict(sorted(present_collections.items()))
 
-            if total_hits <= doc_threshold:
-                return True
-            else:
-                return False
-
-        def build_missing_info(r: list[dict]) -> MissingInfo:
-            agg = self.get_aggregations(
-                attribute="collections.nodeRef.id.keyword")
-            buckets = oeh.build_buckets_from_agg(agg)
-            res = set()
-            for item in r:
-                _id = item.get("_source").get("nodeRef").get("id")
-                title = item.get("_source").get("properties").get("cm:title")
-                # check if a corresponding collection is in buckets and add doc count from there
-                doc_count = next((bucket.doc_count for bucket in buckets if bucket == _id), 0)
-                if doc_count <= doc_threshold:
-                    # check if there is content in subcollections
-                    if check_for_resources_in_subcollection(_id):
-                        res.add(MissingInfo(_id=_id, title=title, doc_count=doc_count, _type="ccm:map"))
-            return res
+    def get_collection_tree(self) -> CollectionTree:
+        if self.collection_tree is None:
+            self.refresh_collection_tree()
+        return self.collection_tree
 
-        if fachportal_key:
-            r_collection_children = self.get_collection_children_by_id(fachportal_key)
-            collection_children: set[MissingInfo] = build_missing_info(
-                r_collection_children.get("hits", {}).get("hits", []))
-            return collection_children
-        else:
-            present_collections: dict[str, set[MissingInfo]] = {}
+    def refresh_collection_tree(self):
+        """
+        Builds the collection tree from all collections and the number of documents in each of them.
+        """
+        collections: dict[str, tuple[str, list[str]]] = {}
+        for hit in self.scan_hits(
+            query={"terms": {"type": ["ccm:map"]}},
+            source=["nodeRef.id", "path", "properties.cm:title"]
+        ):
+            source: dict = hit.get("_source", {})
+            _id = source.get("nodeRef", {}).get("id")
+            title = source.get("properties", {}).get("cm:title")
+            collections[_id] = (title, source.get("path", []))
+
+        doc_counts = {
+            bucket.key: bucket.doc_count
+            for bucket in self.iter_aggregation_buckets(attribute="collections.nodeRef.id.keyword")
+        }
+        # a document is counted once for every collection it is in or below
+        subtree_counts = {
+            bucket.key: bucket.doc_count
+            for bucket in self.iter_aggregation_buckets(attribute=None, script=SUBTREE_IDS_SCRIPT)
+        }
 
-            for key in collection_ids:
-                # for each fp portal query es for all of its collections
-                r_collection_children = self.get_collection_children_by_id(key)
-                collection_children: set[MissingInfo] = build_missing_info(r_collection_children.get("hits", {}).get("hits", []))
-                present_collections[key] = collection_children
-            return dict(sorted(present_collections.items()))
+        self.collection_tree = CollectionTree(collections, doc_counts, subtree_counts)
+        logger.info(f"built collection tree with {len(self.collection_tree)} collections")
 
-    def query_elastic(self, body, index, pretty: bool = True):
-        try:
-            r = self.es.search(body=body, index=index, pretty=pretty)
-            self.connection_retries = 0
+    def submit(self, func: Callable[..., Any], *args) -> Future:
+        """
+        Calls func with args in the shared thread pool, in a copy of the callers context,
+        so stale results are still collected.
+        Called from a thread of the pool, func is called right away instead,
+        so a task never waits for tasks queued behind it.
+        """
+        if getattr(_pool_thread, "active", False):
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return EXECUTOR.submit(copy_context().run, func, *args)
+
+    def run_concurrently(self, func: Callable[[Any], Any], items: Iterable) -> list:
+        """
+        Calls func for each of the items in the shared thread pool,
+        e.g. to issue the queries of several Fachportale at the same time.
+
+        :return: the results in the order of the items
+        """
+        futures = [self.submit(func, item) for item in items]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def call_es(method: Callable[..., dict], **kwargs) -> dict:
+        """
+        Sends a request to elastic once one of the ES_SLOTS is free.
+        """
+        with ES_SLOTS:
+            return method(**kwargs)
+
+    def query_elastic(self, body, index, pretty: bool = True, use_cache: bool = True):
+        """
+        Returns the es-query-result for body and index.
+        If elastic is not reachable, the last result of the same query is returned, marked as stale.
+
+        :param use_cache: set to False for queries that are never repeated
+        """
+        # the metrics are labelled by the method that sent the query
+        method = metrics.caller_name()
+        with metrics.track(method, index, ignore=(ServiceUnavailableError,)):
+            if self.cache is not None and use_cache:
+                cached = self.cache.get(index, body)
+                if cached is not None:
+                    return cached
+            try:
+                r = self.retry_policy.call(
+                    lambda: self.call_es(self.es.search, body=body, index=index, pretty=pretty), self.circuit_breaker)
+            except ServiceUnavailableError:
+                metrics.ERRORS.inc(method, index)
+                if not use_cache:
+                    raise
+                return self.get_stale_result(index, body)
+            size = len(json.dumps(r, default=str))
+            metrics.observe_size(size, method, index)
+            if self.cache is not None and use_cache:
+                self.cache.set(index, body, r, size=size)
             return r
-        except ConnectionError:
-            if self.connection_retries < MAX_CONN_RETRIES:
-                self.connection_retries += 1
-                logger.error(
-                    f"Connection error while trying to reach elastic instance, trying again in 30 seconds. Retries {self.connection_retries}")
-                sleep(30)
-                return self.query_elastic(body, index, pretty)
+
+    def multi_query_elastic(self, searches: dict[Hashable, tuple[str, dict]]) -> dict[Hashable, dict]:
+        """
+        Sends several searches in a single _msearch round trip.
+        If elastic is not reachable, the last results of the same searches are returned, marked as stale.
+        Failed searches are handled like failed single queries, see handle_msearch_error.
+
+        :param searches: dict with keys of the callers choice and (index, body) tuples as values
+        :return: dict with the same keys and the respective es-query-results as values
+        """
+        method = metrics.caller_name()
+        index = ",".join(sorted({index for index, _ in searches.values()}))
+        with metrics.track(method, index, ignore=(ServiceUnavailableError,)):
+            results = {}
+            if self.cache is not None:
+                for key, (search_index, body) in searches.items():
+                    cached = self.cache.get(search_index, body)
+                    if cached is not None:
+                        results[key] = cached
+            # only send the searches without a cached result
+            keys = [key for key in searches if key not in results]
+            if not keys:
+                return results
+
+            msearch_body = []
+            for key in keys:
+                search_index, body = searches[key]
+                msearch_body.extend([{"index": search_index}, body])
+
+            try:
+                r = self.retry_policy.call(
+                    lambda: self.call_es(self.es.msearch, body=msearch_body), self.circuit_breaker)
+            except ServiceUnavailableError:
+                metrics.ERRORS.inc(method, index)
+                for key in keys:
+                    results[key] = self.get_stale_result(*searches[key])
+                return {key: results[key] for key in searches}
+
+            responses: list[dict] = r.get("responses", [])
+            for i, key in enumerate(keys):
+                response = responses[i] if i < len(responses) else {"error": "missing in the msearch response"}
+                if "error" in response:
+                    results[key] = self.handle_msearch_error(key, searches[key], response, method, index)
+                    continue
+                size = len(json.dumps(response, default=str))
+                metrics.observe_size(size, method, index)
+                if self.cache is not None:
+                    self.cache.set(*searches[key], response, size=size)
+                results[key] = response
+            return {key: results[key] for key in searches}
+
+    def handle_msearch_error(
+        self,
+        key: Hashable,
+        search: tuple[str, dict],
+        response: dict,
+        method: str,
+        index: str
+        ) -> dict:
+        """
+        Handles a failed search of an _msearch request like a failed single query:
+        errors of the query are raised, for an unavailable cluster the last result is returned, marked as stale.
+        """
+        logger.error(f"Error in msearch response for {key}: {response.get('error')}")
+        metrics.ERRORS.inc(method, index)
+        error = response.get("error")
+        error_type = error.get("type", "") if isinstance(error, dict) else str(error)
+        exception = TransportError(response.get("status", "N/A"), error_type, error)
+        if response.get("status") is not None and not is_service_error(exception):
+            raise exception
+        return self.get_stale_result(*search)
+
+    def get_stale_result(self, index: str, body: dict) -> dict:
+        """
+        Returns the last result of a query, marked with "_stale": True
+        and recorded for the page that is built, see collect_stale_results.
+        Raises a ServiceUnavailableError if there is none.
+        """
+        stale = self.cache.get_stale(index, body) if self.cache is not None else None
+        if stale is None:
+            raise ServiceUnavailableError("elastic is not reachable and there is no previous result for the query")
+        logger.warning(f"elastic is not reachable, serving a stale result from index: {index}")
+        mark_stale("elastic")
+        return {**stale, "_stale": True}
 
     def getBaseCondition(self, collection_id: str = None, additional_must: dict = None) -> dict:
         must_conditions = [
@@ -227,30 +566,54 @@ class OEHElastic:
         Returns an es-query-result with collections that have a given missing attribute.
         If count is set to 0, only the total number will be returned.
         """
+        body = self.collection_by_missing_attribute_body(collection_id, attribute, size)
+        return self.query_elastic(body=body, index="workspace", pretty=True)
+
+    def collection_by_missing_attribute_body(self, collection_id: str, attribute: str, size: int = 10000) -> dict:
+        """
+        Returns the query body for collections that have a given missing attribute.
+        """
         body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"terms": {"type": ['ccm:map']}},
-                        {"terms": {"permissions.read": ['GROUP_EVERYONE']}},
-                        {"bool": {
-                            "should": [
-                                {"match": {"path": collection_id}},
-                                {"match": {"nodeRef.id": collection_id}}
-                            ],
-                            "minimum_should_match": 1
-                        }
-                        },
-                    ],
-                    "must_not": [{"wildcard": {attribute: "*"}}]
-                }
-            },
+            "query": self.collection_by_missing_attribute_query(collection_id, attribute),
             "_source": SOURCE_FIELDS,
             "size": size,
             "track_total_hits": True
         }
-        # print(body)
-        return self.query_elastic(body=body, index="workspace", pretty=True)
+        return body
+
+    def getCollectionCondition(self, collection_id: str) -> dict:
+        """
+        Returns the condition for public collections that are the given collection or one of its subcollections.
+        """
+        return {
+            "bool": {
+                "must": [
+                    {"terms": {"type": ['ccm:map']}},
+                    {"terms": {"permissions.read": ['GROUP_EVERYONE']}},
+                    {"bool": {
+                        "should": [
+                            {"match": {"path": collection_id}},
+                            {"match": {"nodeRef.id": collection_id}}
+                        ],
+                        "minimum_should_match": 1
+                    }
+                    },
+                ]
+            }
+        }
+
+    def collection_by_missing_attribute_query(self, collection_id: str, attribute: str) -> dict:
+        """
+        Returns the query for collections that have a given missing attribute.
+        """
+        return {
+            "bool": {
+                "must": [
+                    self.getCollectionCondition(collection_id),
+                ],
+                "must_not": [{"wildcard": {attribute: "*"}}]
+            }
+        }
 
 
     def get_collection_children_by_id(self, collection_id: str):
@@ -283,26 +646,45 @@ class OEHElastic:
         Returns the es-query result for a given collection_id and the attribute.
         If count is set to 0, just the total number will be returned in the es-query-result.
         """
+        body = self.material_by_missing_attribute_body(collection_id, attribute, size)
+        return self.query_elastic(body=body, index="workspace", pretty=True)
+
+    def material_by_missing_attribute_body(self, collection_id: str, attribute: str, size: int = 10000) -> dict:
+        """
+        Returns the query body for materials of a collection that have a given missing attribute.
+        """
         body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        self.getBaseCondition(collection_id),
-                    ],
-                    "must_not": [{"wildcard": {attribute: "*"}}]
-                }
-            },
+            "query": self.material_by_missing_attribute_query(collection_id, attribute),
             "_source": SOURCE_FIELDS,
             "size": size,
             "track_total_hits": True
         }
-        # pprint(body)
-        return self.query_elastic(body=body, index="workspace", pretty=True)
+        return body
+
+    def material_by_missing_attribute_query(self, collection_id: str, attribute: str) -> dict:
+        """
+        Returns the query for materials of a collection that have a given missing attribute.
+        """
+        return {
+            "bool": {
+                "must": [
+                    self.getBaseCondition(collection_id),
+                ],
+                "must_not": [{"wildcard": {attribute: "*"}}]
+            }
+        }
 
     def getStatisicCounts(self, collection_id: str, attribute: str = "properties.ccm:commonlicense_key.keyword") -> dict:
         """
         Returns count of values for a given attribute (default: license) in a collection
         """
+        body = self.statistic_counts_body(collection_id, attribute)
+        return self.query_elastic(body=body, index="workspace", pretty=True)
+
+    def statistic_counts_body(self, collection_id: str, attribute: str = "properties.ccm:commonlicense_key.keyword") -> dict:
+        """
+        Returns the query body to count the values of a given attribute (default: license) in a collection
+        """
         body = {
             "query": {
                 "bool": {
@@ -321,13 +703,31 @@ class OEHElastic:
             "size": 0,
             "track_total_hits": True
         }
-        # print(body)
-        return self.query_elastic(body=body, index="workspace", pretty=True)
+        return body
 
     def get_material_by_condition(self, collection_id: str, condition: Literal["missing_license"] = None, count=10000) -> dict:
         """
         Returns count of values for a given attribute (default: license)
         """
+        body = self.material_by_condition_body(collection_id, condition, count)
+        return self.query_elastic(body=body, index="workspace", pretty=True)
+
+    def material_by_condition_body(self, collection_id: str, condition: Literal["missing_license"] = None, count=10000) -> dict:
+        """
+        Returns the query body for materials of a collection matching a given condition.
+        """
+        body = {
+            "query": self.material_by_condition_query(collection_id, condition),
+            "_source": SOURCE_FIELDS,
+            "size": count,
+            "track_total_hits": True
+        }
+        return body
+
+    def material_by_condition_query(self, collection_id: str, condition: Literal["missing_license"] = None) -> dict:
+        """
+        Returns the query for materials of a collection matching a given condition.
+        """
         if condition == "missing_license":
             additional_condition = {
                 "terms": {
@@ -336,35 +736,125 @@ class OEHElastic:
             }
         else:
             additional_condition = None
+        return {
+            "bool": {
+                "must": [
+                    self.getBaseCondition(
+                        collection_id, additional_condition),
+                ]
+            }
+        }
+
+    def paginated_body(
+        self,
+        query: dict,
+        size: int = MISSING_INFO_PAGE_SIZE,
+        search_after: list = None,
+        source: list = SOURCE_FIELDS
+        ) -> dict:
+        """
+        Returns a query body for one page of results with the exact total number of hits.
+        The results are sorted by a stable key, so the next page starts after the sort values
+        of the last hit, given as search_after.
+        """
+        body = {
+            "query": query,
+            "_source": source,
+            "size": size,
+            "sort": PAGINATION_SORT,
+            "track_total_hits": True
+        }
+        if search_after:
+            body["search_after"] = search_after
+        return body
+
+    def scan_hits(
+        self,
+        query: dict,
+        index: str = "workspace",
+        source: list = SOURCE_FIELDS,
+        page_size: int = 10000
+        ) -> Generator[dict, None, None]:
+        """
+        Yields all hits of a query, paging through them with search_after.
+        """
+        search_after = None
+        while True:
+            body = self.paginated_body(query, size=page_size, search_after=search_after, source=source)
+            hits: list = self.query_elastic(body=body, index=index, pretty=True).get("hits", {}).get("hits", [])
+            yield from hits
+            if len(hits) < page_size:
+                return
+            search_after = hits[-1].get("sort")
+
+    def quality_counts_body(
+        self,
+        collection_id: str,
+        missing_filters: dict[str, dict],
+        attribute: str = "properties.ccm:commonlicense_key.keyword"
+        ) -> dict:
+        """
+        Returns a size 0 query body that counts the materials of a collection, the values of a given attribute
+        (default: license) and the documents matching each of the missing_filters in a single filters aggregation.
+
+        :param missing_filters: dict with names as keys and the queries to count as values
+        """
         body = {
             "query": {
                 "bool": {
-                    "must": [
-                        self.getBaseCondition(
-                            collection_id, additional_condition),
-                    ]
+                    "should": [
+                        self.getBaseCondition(collection_id),
+                        self.getCollectionCondition(collection_id)
+                    ],
+                    "minimum_should_match": 1
                 }
             },
-            "_source": SOURCE_FIELDS,
-            "size": count,
+            "aggs": {
+                "resources": {
+                    "filter": self.getBaseCondition(collection_id),
+                    "aggs": {
+                        "license": {
+                            "terms": {
+                                "field": attribute,
+                            }
+                        }
+                    }
+                },
+                "missing": {
+                    "filters": {
+                        "filters": missing_filters
+                    }
+                }
+            },
+            "size": 0,
             "track_total_hits": True
         }
-        # print(body)
-        return self.query_elastic(body=body, index="workspace", pretty=True)
+        return body
 
-    def get_oeh_search_analytics(self, timestamp: str = None, count: int = 10000):
+    def get_oeh_search_analytics(self, timestamp: str = None, count: float = inf) -> bool:
         """
-        Returns the oeh search analytics.
+        Updates the oeh search analytics.
+        If a refresh is already running, the call returns immediately.
+
+        :return: True if the analytics were refreshed, False if the call was skipped
         """
-        def filter_search_strings(unfiltered: list[dict]) -> Generator:
-            for item in unfiltered:
-                search_string = item.get(
-                    "_source", {}).get("searchString", None)
-                if search_string and search_string.strip() != "":
-                    yield search_string
-                else:
-                    continue
+        if not self.analytics_lock.acquire(blocking=False):
+            logger.info("search analytics are already being refreshed, skipping")
+            return False
+        try:
+            self.update_oeh_search_analytics(timestamp=timestamp, count=count)
+            return True
+        finally:
+            self.analytics_lock.release()
+
+    def update_oeh_search_analytics(self, timestamp: str = None, count: float = inf):
+        """
+        Streams the oeh search analytics newer than timestamp (default: last seen timestamp)
+        page by page and updates the searched materials.
+        Use get_oeh_search_analytics to avoid concurrent updates.
 
+        :param count: maximum number of events to ingest
+        """
         if not timestamp:
             gt_timestamp = self.last_timestamp
             logger.info(f"searching with a gt timestamp of: {gt_timestamp}")
@@ -372,6 +862,187 @@ class OEHElastic:
             gt_timestamp = timestamp
             logger.info(f"searching with a given timestamp of: {gt_timestamp}")
 
+        # we have to check if path contains one of the edu-sharing collections with an elastic query
+        # get fpm collections
+        collections = EduSharing.get_collections()
+        collection_ids = [item.get("properties").get("sys:node-uuid")[0] for item in collections]
+
+        updated_materials: dict[str, SearchedMaterialInfo] = {}
+        events = 0
+        # the next batch is fetched while the current one is processed
+        batches = concat_pages(self.iter_search_analytics(gt_timestamp, count=count), ANALYTICS_BATCH_SIZE)
+        for hits in prefetch(batches):
+            self.update_searched_materials(hits, collection_ids, updated_materials)
+            # set last timestamp to last timestamp of the processed events
+            self.last_timestamp = hits[-1].get("_source", {}).get("timestamp")
+            events += len(hits)
+        logger.info(f"ingested {events} search analytics events, {len(updated_materials)} materials updated")
+
+        self.update_materials_by_collection(updated_materials)
+        evicted = self.evict_searched_materials()
+        if self.snapshot and (events or evicted):
+            self.snapshot.save(self.all_searched_materials.values(), self.last_timestamp, self.day_counts)
+        if events or evicted:
+            self.publish_analytics()
+
+    def evict_searched_materials(self, window_days: float = ANALYTICS_WINDOW_DAYS) -> int:
+        """
+        Removes the materials whose last click is older than window_days, so the memory stays bounded.
+        The materials are ordered by last click, so only the evicted ones are visited.
+
+        :return: number of evicted materials
+        """
+        cutoff = time() - window_days * 24 * 3600
+        evicted: list[SearchedMaterialInfo] = []
+        for material in self.all_searched_materials.values():
+            if material.last_click >= cutoff:
+                break
+            evicted.append(material)
+        if not evicted:
+            return 0
+
+        updated_collections = set()
+        for material in evicted:
+            del self.all_searched_materials[material._id]
+            for fp in (material.fps or ["none"]):
+                self.materials_by_collection.get(fp, {}).pop(material._id, None)
+                updated_collections.add(fp)
+        self.rebuild_searched_materials_by_collection(updated_collections)
+        logger.info(f"evicted {len(evicted)} materials not clicked in the last {window_days} days")
+        return len(evicted)
+
+    def load_snapshot(self):
+        """
+        Restores the searched materials, their daily counts and the last seen timestamp from the snapshot,
+        if there is one.
+        """
+        loaded = self.snapshot.load() if self.snapshot else None
+        if loaded is None:
+            return
+        self.set_analytics(*loaded)
+
+    @property
+    def day_counts(self) -> dict[str, DayBuckets]:
+        return {"clicks": self.clicks_by_day, "search_strings": self.search_strings_by_day}
+
+    def set_analytics(
+        self,
+        materials: list[SearchedMaterialInfo],
+        last_timestamp: str,
+        day_counts: dict[str, list[tuple]]
+    ):
+        """
+        Replaces the searched materials, the last seen timestamp and the daily counts with loaded ones.
+        """
+        self.last_timestamp = last_timestamp
+        self.clicks_by_day = DayBuckets.from_rows(ANALYTICS_WINDOW_DAYS, day_counts.get("clicks", []))
+        self.search_strings_by_day = DayBuckets.from_rows(ANALYTICS_WINDOW_DAYS, day_counts.get("search_strings", []))
+        self.all_searched_materials = {material._id: material for material in materials}
+        self.materials_by_collection = {}
+        self.update_materials_by_collection(self.all_searched_materials)
+        # the lists are replaced rather than cleared first, so pages never see them empty
+        self.searched_materials_by_collection = {
+            fp: searched_materials for fp, searched_materials in self.searched_materials_by_collection.items()
+            if fp in self.materials_by_collection
+        }
+
+    def publish_analytics(self):
+        """
+        Writes the searched materials and the last seen timestamp to the shared store, if there is one.
+        """
+        if self.shared_store is None:
+            return
+        self.shared_store.set(
+            "analytics", dump_analytics(self.all_searched_materials.values(), self.last_timestamp, self.day_counts))
+        self.shared_store.set("analytics:last_timestamp", self.last_timestamp.encode())
+
+    def load_shared_analytics(self, newer_only: bool = False) -> bool:
+        """
+        Replaces the searched materials with the ones published to the shared store,
+        if they are of another last seen timestamp than the local ones.
+
+        :param newer_only: only load analytics newer than the local ones
+        :return: True if the searched materials were replaced
+        """
+        if self.shared_store is None:
+            return False
+        shared_timestamp = self.shared_store.get("analytics:last_timestamp")
+        if shared_timestamp is None or shared_timestamp.decode() == self.last_timestamp:
+            return False
+        # the default timestamp is relative ("now-30d"), loaded timestamps are iso dates
+        if newer_only and self.last_timestamp[:1].isdigit() and shared_timestamp.decode() < self.last_timestamp:
+            return False
+        data = self.shared_store.get("analytics")
+        loaded = load_analytics(data) if data is not None else None
+        if loaded is None:
+            return False
+        materials, last_timestamp, day_counts = loaded
+        with self.analytics_lock:
+            self.set_analytics(materials, last_timestamp, day_counts)
+        logger.info(f"loaded {len(materials)} searched materials up to {last_timestamp} from the shared store")
+        return True
+
+    def iter_search_analytics(
+        self,
+        gt_timestamp: str,
+        count: float = inf,
+        page_size: int = ANALYTICS_PAGE_SIZE
+        ) -> Generator[list[dict], None, None]:
+        """
+        Yields pages of the oeh search analytics events newer than gt_timestamp, oldest first.
+        The pages are fetched with search_after in a point in time, so there is no limit on the number of events.
+
+        :param count: maximum number of events to yield, the newest ones are yielded
+        """
+        time_range = {"gt": gt_timestamp, "lt": "now"}
+        if count < inf:
+            start = self.newest_events_start(gt_timestamp, int(count))
+            if start is not None:
+                # all events from the start on, events with the same timestamp as the start may exceed count
+                time_range = {"gte": start, "lt": "now"}
+                count = inf
+        body = {
+            "query": {
+                "range": {
+                    "timestamp": time_range
+                }
+            },
+            "sort": [
+                {
+                    "timestamp": {
+                        "order": "asc"
+                    }
+                }
+            ]
+        }
+        pit_id = self.open_point_in_time(index="oeh-search-analytics")
+        events = 0
+        try:
+            while events < count:
+                body["size"] = int(min(page_size, count - events))
+                if pit_id:
+                    body["pit"] = {"id": pit_id, "keep_alive": POINT_IN_TIME_KEEP_ALIVE}
+                r: dict = self.query_elastic(
+                    body=body, index=None if pit_id else "oeh-search-analytics", use_cache=False)
+                pit_id = r.get("pit_id", pit_id)
+                hits: list[dict] = r.get("hits", {}).get("hits", [])
+                if hits:
+                    yield hits
+                if len(hits) < body["size"]:
+                    return
+                events += len(hits)
+                # without a point in time, events with the same timestamp at the end of a page may be skipped
+                body["search_after"] = hits[-1].get("sort")
+        finally:
+            if pit_id:
+                self.close_point_in_time(pit_id)
+
+    def newest_events_start(self, gt_timestamp: str, count: int, page_size: int = 10000) -> str:
+        """
+        Returns the timestamp of the count-th newest oeh search analytics event newer than gt_timestamp,
+        None if there are not more than count of them.
+        Only the timestamps are fetched, newest first, page_size at a time.
+        """
         body = {
             "query": {
                 "range": {
@@ -381,7 +1052,7 @@ class OEHElastic:
                     }
                 }
             },
-            "size": count,
+            "_source": ["timestamp"],
             "sort": [
                 {
                     "timestamp": {
@@ -390,91 +1061,130 @@ class OEHElastic:
                 }
             ]
         }
-        query = self.query_elastic(
-            body=body, index="oeh-search-analytics", pretty=True)
-        r: list[dict] = query.get("hits", {}).get("hits", [])
-
-        # set last timestamp to last timestamp from response
-        if len(r):
-            self.last_timestamp = r[0].get("_source", {}).get("timestamp")
-
-        filtered_search_strings = filter_search_strings(r)
-        search_counter = Counter(list(filtered_search_strings))
+        events = 0
+        while True:
+            # one more than count, to know if there are more events
+            body["size"] = min(page_size, count + 1 - events)
+            r: dict = self.query_elastic(body=body, index="oeh-search-analytics", use_cache=False)
+            hits: list[dict] = r.get("hits", {}).get("hits", [])
+            if len(hits) < body["size"]:
+                return None
+            if events + len(hits) > count:
+                return hits[count - events - 1].get("_source", {}).get("timestamp")
+            events += len(hits)
+            body["search_after"] = hits[-1].get("sort")
+
+    def open_point_in_time(self, index: str) -> str:
+        """
+        Returns the id of a new point in time for index or None if the cluster does not support it.
+        """
+        try:
+            return self.call_es(
+                self.es.open_point_in_time, index=index, keep_alive=POINT_IN_TIME_KEEP_ALIVE).get("id")
+        except (TransportError, AttributeError) as e:
+            logger.warning(f"Could not open a point in time for index: {index}, paging without one. {e!r}")
+            return None
 
-        def check_timestamp(new, old):
-            if new > old:
-                return new
-            else:
-                return old
-
-        def filter_for_terms_and_materials(res: list[dict]):
-            """
-            :param list[dict] res: result from elastic-search query
-            """
-            all_materials: set[SearchedMaterialInfo] = set()
-            filtered_res = (item for item in res if item.get(
-                "_source", {}).get("action", None) == "result_click")
-            for item in (item.get("_source", {}) for item in filtered_res):
-                clicked_resource_id = item.get("clickedResult").get("id")
-                timestamp: str = item.get("timestamp", "")
-
-                clicked_resource = SearchedMaterialInfo(
-                    _id=clicked_resource_id,
-                    timestamp=timestamp
-                )
-
-                search_string: str = item.get("searchString", "")
-
-                # we got to check the FPs for the given resource
-                logger.info(
-                    f"checking included fps for resource id: {clicked_resource}")
-
-                # build the object
-                if not clicked_resource in self.all_searched_materials:
-                    logger.info(
-                        f"{clicked_resource} not present, creating entry, getting info...")
-                    result: SearchedMaterialInfo = self.get_resource_info(
-                        clicked_resource._id, list(collections_ids_title.keys()))
-                    result.timestamp = timestamp
-                    result.search_strings.update([search_string])
-                    self.all_searched_materials.add(result)
-                else:
-                    logger.info(f"{clicked_resource!r} present, updating...")
-                    old = next(
-                        e for e in self.all_searched_materials if e == clicked_resource)
-                    # check for newest timestamp
-                    new_timestamp = check_timestamp(timestamp, old.timestamp)
-
-                    clicked_resource.title = old.title
-                    clicked_resource.name = old.name
-                    clicked_resource.fps = old.fps
-                    clicked_resource.creator = old.creator
-                    clicked_resource.search_strings.update([search_string])
-                    clicked_resource.search_strings += old.search_strings
-                    clicked_resource.clicks = old.clicks + 1
-                    clicked_resource.timestamp = new_timestamp
-                    self.all_searched_materials.remove(old)
-                    self.all_searched_materials.add(clicked_resource)
+    def close_point_in_time(self, pit_id: str):
+        try:
+            self.call_es(self.es.close_point_in_time, body={"id": pit_id})
+        except TransportError as e:
+            logger.warning(f"Could not close point in time: {e!r}")
 
-            return True
+    def update_searched_materials(
+        self,
+        hits: list[dict],
+        collection_ids: list[str],
+        updated: dict[str, SearchedMaterialInfo]
+        ):
+        """
+        Updates the searched materials in place with the result clicks.
 
-        # we have to check if path contains one of the edu-sharing collections with an elastic query
-        # get fpm collections
-        collections = EduSharing.get_collections()
-        collections_ids_title = {item.get("properties").get(
-            "sys:node-uuid")[0]: item.get("title") for item in collections}
-        materials_by_terms = filter_for_terms_and_materials(r)
-
-        # assign material to fpm portals
-        collections_by_material = defaultdict(list)
-        for item in sorted(self.all_searched_materials, reverse=True):  # key is the material id
-            if fps := item.fps:
-                for fp in fps:
-                    collections_by_material[fp].append(item)
+        :param hits: search analytics events, sorted by timestamp ascending
+        :param collection_ids: ids of the Fachportal collections
+        :param updated: the updated materials, ordered by last click, are added to this dict
+        """
+        ids, search_strings, clicked_at, days = self.normalize_clicks(hits)
+        if not ids:
+            return
+
+        # get the infos of all materials that are not present yet at once
+        # sorted, so the queries are the same for the same clicks
+        unknown_ids = sorted(set(ids).difference(self.all_searched_materials))
+        if unknown_ids:
+            logger.info(f"{len(unknown_ids)} materials not present, creating entries, getting info...")
+        new_materials = self.get_resources_info(unknown_ids, collection_ids)
+
+        # the counters keep the order of the first occurrence, like the clicks were counted one by one
+        material_clicks = Counter(ids)
+        material_search_strings: dict[str, dict[str, int]] = {}
+        for (_id, search_string), count in Counter(zip(ids, search_strings)).items():
+            material_search_strings.setdefault(_id, {})[search_string] = count
+        for (_id, day), count in Counter(zip(ids, days)).items():
+            self.clicks_by_day.add(_id, day * 24 * 3600, count)
+        for (search_string, day), count in Counter(zip(search_strings, days)).items():
+            self.search_strings_by_day.add(search_string, day * 24 * 3600, count)
+        # the clicks are sorted by timestamp, so the last click of a material is its latest
+        last_positions = {_id: position for position, _id in enumerate(ids)}
+
+        # by last click, so the last clicked material ends up last in the dicts
+        for _id in sorted(last_positions, key=last_positions.get):
+            material = self.all_searched_materials.pop(_id, None)
+            if material is None:
+                material = new_materials[_id]
+            material.add_clicks(material_clicks[_id], clicked_at[last_positions[_id]], material_search_strings[_id])
+
+            self.all_searched_materials[_id] = material
+            updated.pop(_id, None)
+            updated[_id] = material
+
+    def normalize_clicks(self, hits: list[dict]) -> tuple[list[str], list[str], list[float], list[int]]:
+        """
+        Returns the result clicks of the search analytics events as columns:
+        the material ids, the search strings, the timestamps as epoch seconds and as epoch days.
+        """
+        import numpy as np
+
+        ids, search_strings, timestamps = [], [], []
+        for hit in hits:
+            item: dict = hit.get("_source", {})
+            if item.get("action", None) == "result_click":
+                ids.append(item.get("clickedResult").get("id"))
+                search_strings.append(sys.intern(item.get("searchString", "")))
+                # numpy parses iso timestamps without time zone
+                timestamps.append(item.get("timestamp", "").rstrip("Z"))
+        parsed = np.array(timestamps, dtype="datetime64[ms]")
+        clicked_at = np.where(np.isnat(parsed), 0, parsed.astype("int64")) / 1000
+        days = (clicked_at // (24 * 3600)).astype("int64")
+        return ids, search_strings, clicked_at.tolist(), days.tolist()
+
+    def update_materials_by_collection(self, updated: dict[str, SearchedMaterialInfo]):
+        """
+        Assigns the updated materials to the fpm portals, only the lists of touched portals are rebuilt.
+        """
+        updated_collections = set()
+        for _id, material in updated.items():
+            for fp in (material.fps or ["none"]):
+                collection_materials = self.materials_by_collection.setdefault(fp, {})
+                collection_materials.pop(_id, None)
+                collection_materials[_id] = material
+                updated_collections.add(fp)
+        self.rebuild_searched_materials_by_collection(updated_collections)
+
+    def rebuild_searched_materials_by_collection(self, updated_collections: Iterable[str]):
+        """
+        Rebuilds the lists of the given portals, last clicked first.
+        The dict is replaced, so pages reading it never see a partial update.
+        """
+        searched_materials_by_collection = dict(self.searched_materials_by_collection)
+        for fp in updated_collections:
+            materials = self.materials_by_collection.get(fp)
+            if materials:
+                searched_materials_by_collection[fp] = list(reversed(materials.values()))
             else:
-                collections_by_material["none"].append(item)
-
-        self.searched_materials_by_collection = collections_by_material
+                self.materials_by_collection.pop(fp, None)
+                searched_materials_by_collection.pop(fp, None)
+        self.searched_materials_by_collection = searched_materials_by_collection
 
     def get_node_path(self, node_id) -> dict:
         """
@@ -487,49 +1197,75 @@ class OEHElastic:
                     "nodeRef.id": node_id
                 }
             },
-            "_source": [
-                "properties.cclom:title",
-                "properties.cm:name",
-                "collections.path",
-                "properties.ccm:replicationsource",
-                "properties.cm:creator"
-            ]
+            "_source": RESOURCE_INFO_FIELDS
         }
         return self.query_elastic(body=body, index="workspace", pretty=True)
 
+    def node_paths_body(self, node_ids: list[str]) -> dict:
+        """
+        Returns the query body for the collection paths and infos of several nodes
+        """
+        return {
+            "query": {
+                "terms": {
+                    "nodeRef.id.keyword": node_ids
+                }
+            },
+            "_source": RESOURCE_INFO_FIELDS,
+            "size": len(node_ids)
+        }
+
     def get_resource_info(self, resource_id: str, collection_ids: list) -> SearchedMaterialInfo:
         """
         Gets info about a resource from elastic
         """
-        try:
-            hit: dict = self.get_node_path(resource_id).get(
-                "hits", {}).get("hits", [])[0]
-            paths = hit.get("_source").get(
-                "collections", [{}])[0].get("path", [])
-            name = hit.get("_source").get("properties", {}).get(
-                "cm:name", None)  # internal name
-            title = hit.get("_source").get("properties", {}).get(
-                "cclom:title", None)  # readable title
-            content_url = hit.get("_source").get("properties", {}).get(
-                "ccm:wwwurl", None) # Source page url
-            crawler = hit.get("_source").get("properties", {}).get(
-                "ccm:replicationsource", None)
-            creator = hit.get("_source").get("properties", {}).get(
-                "cm:creator", None)
-            included_fps = {path for path in paths if path in collection_ids}
-            return SearchedMaterialInfo(
-                _id=resource_id,
-                name=name,
-                title=title,
-                clicks=1,
-                crawler=crawler,
-                content_url=content_url,
-                creator=creator,
-                fps=included_fps
-            )
-        except Exception as e:
-            logger.exception()
-            return SearchedMaterialInfo()
+        return self.get_resources_info([resource_id], collection_ids)[resource_id]
+
+    def get_resources_info(self, resource_ids: list[str], collection_ids: list) -> dict[str, SearchedMaterialInfo]:
+        """
+        Gets infos about several resources from elastic with chunked terms queries, sent in one _msearch request.
+        Resources that can not be found only get their id.
+
+        :return: dict with the resource ids as keys
+        """
+        chunks = {
+            i: ("workspace", self.node_paths_body(resource_ids[i:i + RESOURCE_INFO_CHUNK_SIZE]))
+            for i in range(0, len(resource_ids), RESOURCE_INFO_CHUNK_SIZE)
+        }
+        responses = self.multi_query_elastic(chunks) if chunks else {}
+
+        resources_info: dict[str, SearchedMaterialInfo] = {}
+        for response in responses.values():
+            for hit in response.get("hits", {}).get("hits", []):
+                resource_id = hit.get("_source", {}).get("nodeRef", {}).get("id")
+                if resource_id not in resources_info:
+                    resources_info[resource_id] = self.parse_resource_info(hit, collection_ids)
+
+        for resource_id in resource_ids:
+            if resource_id not in resources_info:
+                logger.error(f"Could not get info about resource: {resource_id}")
+                resources_info[resource_id] = SearchedMaterialInfo(_id=resource_id)
+        return resources_info
+
+    def parse_resource_info(self, hit: dict, collection_ids: list) -> SearchedMaterialInfo:
+        source: dict = hit.get("_source", {})
+        paths = (source.get("collections") or [{}])[0].get("path", [])
+        properties: dict = source.get("properties", {})
+        name = properties.get("cm:name", None)  # internal name
+        title = properties.get("cclom:title", None)  # readable title
+        content_url = properties.get("ccm:wwwurl", None)  # Source page url
+        crawler = properties.get("ccm:replicationsource", None)
+        creator = properties.get("cm:creator", None)
+        included_fps = {path for path in paths if path in collection_ids}
+        return SearchedMaterialInfo(
+            _id=source.get("nodeRef", {}).get("id"),
+            name=name,
+            title=title,
+            crawler=crawler,
+            content_url=content_url,
+            creator=creator,
+            fps=included_fps
+        )
 
     def get_aggregations(
         self,
@@ -578,7 +1314,86 @@ class OEHElastic:
 
         return r
 
-    def build_buckets_from_agg(self, agg: dict, include_other: bool = False) -> list[Bucket]:
+    def iter_aggregation_buckets(
+        self,
+        attribute: str,
+        collection_id: str = None,
+        index: str = "workspace",
+        page_size: int = AGGREGATION_PAGE_SIZE,
+        script: str = None
+        ) -> Generator[Bucket, None, None]:
+        """
+        Yields a bucket for every value of a given attribute, in the order of the values.
+        Pages through a composite aggregation with after_key, so the counts are exact for any number of values,
+        unlike the terms aggregation of get_aggregations that drops all but the size most frequent ones.
+
+        :param script: painless script returning the values of a document, aggregated instead of attribute
+        """
+        source = {"script": {"source": script, "lang": "painless"}} if script else {"field": attribute}
+        composite = {
+            "size": page_size,
+            "sources": [{"key": {"terms": source}}]
+        }
+        body = {
+            "size": 0,
+            "aggs": {
+                "my-agg": {"composite": composite}
+            }
+        }
+        if index == "workspace":
+            body["query"] = {
+                "bool": {
+                    "must": [
+                        self.getBaseCondition(collection_id),
+                    ]
+                }
+            }
+        while True:
+            r: dict = self.query_elastic(body=body, index=index, pretty=True)
+            my_agg = r.get("aggregations", {}).get("my-agg", {})
+            buckets = my_agg.get("buckets", [])
+            for b in buckets:
+                yield Bucket(b["key"]["key"], b["doc_count"])
+            after_key = my_agg.get("after_key")
+            if not buckets or after_key is None:
+                return
+            composite["after"] = after_key
+
+    def attribute_distribution_body(self, attributes: list[str], size: int = 10) -> dict:
+        """
+        Returns the body for the top terms and the missing count of all attributes in one query.
+        The aggregations are named "<attribute>-terms" and "<attribute>-missing".
+        """
+        aggs = {}
+        for attribute in attributes:
+            aggs[f"{attribute}-terms"] = {"terms": {"field": attribute, "size": size}}
+            aggs[f"{attribute}-missing"] = {"missing": {"field": attribute}}
+        body = {
+            "query": {
+                "bool": {
+                    "must": [
+                        self.getBaseCondition(),
+                    ]
+                }
+            },
+            "size": 0,
+            "aggs": aggs
+        }
+        return body
+
+    def get_attribute_distribution(self, attributes: list[str], size: int = 10) -> dict[str, list[Bucket]]:
+        """
+        Returns the buckets of the top size terms, the other terms and the missing documents by attribute.
+        """
+        r: dict = self.query_elastic(body=self.attribute_distribution_body(attributes, size), index="workspace")
+        return {
+            attribute: [
+                *self.build_buckets_from_agg(r, include_other=True, agg_name=f"{attribute}-terms"),
+                self.get_doc_count_from_missing_agg(r, agg_name=f"{attribute}-missing")
+            ] for attribute in attributes
+        }
+
+    def build_buckets_from_agg(self, agg: dict, include_other: bool = False, agg_name: str = "my-agg") -> list[Bucket]:
         """
         Builds the buckets from an aggregation query.
         Return is a list of dicts with keys: key, doc_count
@@ -586,7 +1401,7 @@ class OEHElastic:
         def build_buckets(buckets):
             return [Bucket(b["key"], b["doc_count"]) for b in buckets]
 
-        my_agg = agg.get("aggregations", {}).get("my-agg", {})
+        my_agg = agg.get("aggregations", {}).get(agg_name, {})
         buckets: list[Bucket] = build_buckets(
             my_agg.get("buckets", []))
 
@@ -596,34 +1411,71 @@ class OEHElastic:
             buckets.append(other_bucket)
         return buckets
 
-    def get_doc_count_from_missing_agg(self, agg:dict) -> Bucket:
-        doc_count = agg.get("aggregations", {}).get("my-agg", {}).get("doc_count", None)
+    def get_doc_count_from_missing_agg(self, agg:dict, agg_name: str = "my-agg") -> Bucket:
+        doc_count = agg.get("aggregations", {}).get(agg_name, {}).get("doc_count", None)
         bucket = Bucket("missing", doc_count)
         return bucket
 
-    def build_df_from_buckets(self, buckets) -> pd.DataFrame:
-        d = [b.as_dict() for b in buckets]
-        df = pd.DataFrame(d)
-        return df
+    def build_df_from_buckets(self, buckets: Iterable[Bucket], chunk_size: int = AGGREGATION_PAGE_SIZE) -> "pd.DataFrame":
+        """
+        Builds a DataFrame with the columns key and doc_count from buckets, chunk_size buckets at a time,
+        so a generator of buckets is never held as a whole list of dicts.
+        """
+        import pandas as pd
+
+        buckets = iter(buckets)
+        chunks = []
+        while True:
+            chunk = list(islice(buckets, chunk_size))
+            if not chunk:
+                break
+            chunks.append(pd.DataFrame({
+                "key": [b.key for b in chunk],
+                "doc_count": [b.doc_count for b in chunk]
+            }))
+        if not chunks:
+            return pd.DataFrame(columns=["key", "doc_count"])
+        return pd.concat(chunks, ignore_index=True)
 
     def sort_searched_materials(self) -> list[SearchedMaterialInfo]:
         """
-        Sorts searched materials by last click.
+        Returns the searched materials sorted by last click.
+        """
+        return list(reversed(self.all_searched_materials.values()))
+
+    def clicks_in_window(
+        self,
+        materials: list[SearchedMaterialInfo],
+        days: int = ANALYTICS_WINDOW_DAYS
+    ) -> list[tuple[SearchedMaterialInfo, int]]:
+        """
+        Returns the materials clicked in the last days days with their number of clicks in that time.
+
+        :param materials: materials sorted by last click, last clicked first
+        """
+        cutoff = time() - days * 24 * 3600
+        clicks_by_day = self.clicks_by_day
+        result = []
+        for material in materials or []:
+            if material.last_click < cutoff:
+                break
+            clicks = clicks_by_day.count(material._id, days)
+            if clicks:
+                result.append((material, clicks))
+        return result
+
+    def search_strings_in_window(self, days: int = ANALYTICS_WINDOW_DAYS) -> list[Bucket]:
+        """
+        Returns the search strings of the clicks in the last days days with their number of clicks, most clicked first.
         """
-        searched_materials_all: set[SearchedMaterialInfo] = set()
-        for key in self.searched_materials_by_collection:
-            searched_materials_all.update(
-                self.searched_materials_by_collection[key])
-        sorted_search = sorted(
-            searched_materials_all,
-            key=lambda x: x.timestamp,
-            reverse=True)
-        return sorted_search
+        totals = self.search_strings_by_day.totals(days)
+        return [Bucket(key, doc_count) for key, doc_count in sorted(totals.items(), key=lambda item: -item[1])]
 
 
 oeh = OEHElastic()
 
 if __name__ == "__main__":
     print("\n\n\n\n")
+    oeh.warm_up()
     oeh.collections_by_fachportale()
     oeh.get_oeh_search_analytics()
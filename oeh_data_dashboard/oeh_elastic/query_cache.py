@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from oeh_data_dashboard.oeh_elastic.shared_store import SharedStore
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", 60))  # seconds
+# seconds a cached result stays valid by index, falls back to QUERY_CACHE_TTL
+QUERY_CACHE_TTLS = {
+    "workspace": 300,
+}
+
+
+class QueryCache:
+    """
+    TTL and LRU cache for es-query-results, keyed on a canonical hash of index and body.
+    The size of the cached results is estimated by their json length and capped at max_bytes.
+    Expired results are kept until they are evicted, so they can still be served as stale results.
+    With a shared store, results are also written to it and looked up there on a local miss,
+    so the workers of a deployment query each result only once.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = QUERY_CACHE_MAX_BYTES,
+        ttls: dict[str, int] = None,
+        default_ttl: int = QUERY_CACHE_TTL,
+        shared: SharedStore = None
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttls = QUERY_CACHE_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.shared = shared
+        # key -> (expiry time, size, result), least recently used first
+        self.entries: OrderedDict[str, tuple[float, int, dict]] = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.shared_hits: int = 0
+        self.evictions: int = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def make_key(index: str, body: dict) -> str:
+        return hashlib.sha1(json.dumps([index, body], sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, index: str, body: dict) -> dict:
+        """
+        Returns the cached result for index and body or None if there is no valid one.
+        """
+        key = self.make_key(index, body)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] >= monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+        result = self.get_shared(index, key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.shared_hits += 1
+        return result
+
+    def get_shared(self, index: str, key: str) -> dict:
+        """
+        Returns the result for key from the shared store and caches it locally, None if it is not there.
+        """
+        if self.shared is None:
+            return None
+        data = self.shared.get(f"query:{key}")
+        if data is None:
+            return None
+        result_json = zlib.decompress(data).decode()
+        result = json.loads(result_json)
+        self.add(key, result, len(result_json), self.ttls.get(index, self.default_ttl))
+        return result
+
+    def get_stale(self, index: str, body: dict) -> dict:
+        """
+        Returns the last cached result for index and body, even if it is expired, or None.
+        """
+        with self._lock:
+            entry = self.entries.get(self.make_key(index, body))
+            return entry[2] if entry is not None else None
+
+    def set(self, index: str, body: dict, result: dict, size: int = None):
+        """
+        :param size: json length of result if it is already known
+        """
+        ttl = self.ttls.get(index, self.default_ttl)
+        if ttl <= 0:
+            return
+        key = self.make_key(index, body)
+        if self.shared is not None:
+            result_json = json.dumps(result, default=str)
+            size = len(result_json)
+            self.shared.set(f"query:{key}", zlib.compress(result_json.encode()), ttl=ttl)
+        elif size is None:
+            size = len(json.dumps(result, default=str))
+        self.add(key, result, size, ttl)
+
+    def add(self, key: str, result: dict, size: int, ttl: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (monotonic() + ttl, size, result)
+            self.size += size
+            # evict least recently used results
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "evictions": self.evictions
+        }
+
+    def _remove(self, key: str):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Callable, Generator
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", 5))
+CIRCUIT_BREAKER_RESET_TIMEOUT = int(os.getenv("CIRCUIT_BREAKER_RESET_TIMEOUT", 30))  # seconds
+RETRY_BASE_DELAY = 0.5  # seconds
+RETRY_MAX_DELAY = 10  # seconds
+
+# services of the stale results served in the current context, None if they are not collected
+_stale_sources: ContextVar[set] = ContextVar("stale_sources", default=None)
+
+
+class ServiceUnavailableError(Exception):
+    """
+    Raised if a service can not be reached and there is no previous result to fall back to.
+    """
+
+
+def mark_stale(source: str):
+    """
+    Records that a stale result of source was served, if collect_stale_results is active.
+    """
+    sources = _stale_sources.get()
+    if sources is not None:
+        sources.add(source)
+
+
+@contextmanager
+def collect_stale_results() -> Generator[set, None, None]:
+    """
+    Yields the set of services that served a stale result within the block,
+    e.g. to show a notice on a page built from them.
+    """
+    sources = set()
+    token = _stale_sources.set(sources)
+    try:
+        yield sources
+    finally:
+        _stale_sources.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of a service. After failure_threshold failures the circuit opens
+    and requests fail fast for reset_timeout seconds. Then a single trial request is let through,
+    which closes the circuit again on success.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_BREAKER_THRESHOLD,
+        reset_timeout: int = CIRCUIT_BREAKER_RESET_TIMEOUT
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures: int = 0
+        self.opened_at: float = None
+        self._trial_running: bool = False
+        self._lock = Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        elif monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        else:
+            return "half_open"
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            elif state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"{self.name} is reachable again, closing circuit")
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def release_trial(self):
+        """
+        Ends a trial request that neither succeeded nor failed because of the service, e.g. a bad query,
+        so the next request can try again.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.error(
+                        f"{self.name} failed {self.failures} times, failing fast for {self.reset_timeout} seconds")
+                self.opened_at = monotonic()
+
+
+class RetryPolicy:
+    """
+    Retries a call with exponential backoff and full jitter as long as the circuit breaker allows it.
+    """
+
+    def __init__(
+        self,
+        max_retries: float,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        retry_on: tuple = (Exception,),
+        is_failure: Callable[[Exception], bool] = None
+    ) -> None:
+        """
+        :param max_retries: maximum number of retries per call, can be inf as the circuit breaker still ends the retries
+        :param retry_on: exceptions that count as a failure of the service
+        :param is_failure: returns True for other exceptions that count as a failure of the service,
+            they are raised without retrying
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.is_failure = is_failure
+
+    def delays(self) -> Generator[float, None, None]:
+        attempt = 0
+        while attempt < self.max_retries:
+            yield random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            attempt += 1
+
+    def call(self, func: Callable[[], Any], circuit_breaker: CircuitBreaker) -> Any:
+        """
+        Returns the result of func.
+        Raises a ServiceUnavailableError if the circuit is open or all retries failed.
+        """
+        delays = self.delays()
+        while True:
+            if not circuit_breaker.allow_request():
+                raise ServiceUnavailableError(f"{circuit_breaker.name} is not reachable, circuit is open")
+            try:
+                result = func()
+            except self.retry_on as e:
+                circuit_breaker.record_failure()
+                delay = next(delays, None)
+                if delay is None:
+                    raise ServiceUnavailableError(f"{circuit_breaker.name} is not reachable") from e
+                logger.error(
+                    f"Error while trying to reach {circuit_breaker.name}: {e!r}, trying again in {delay:.1f} seconds")
+                sleep(delay)
+            except BaseException as e:
+                # every other exception ends the call, so it has to end a trial request as well
+                if isinstance(e, Exception) and self.is_failure is not None and self.is_failure(e):
+                    circuit_breaker.record_failure()
+                else:
+                    circuit_breaker.release_trial()
+                raise
+            else:
+                circuit_breaker.record_success()
+                return result
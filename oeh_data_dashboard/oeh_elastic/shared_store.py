@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import abc
+import logging
+import os
+import sqlite3
+import uuid
+from threading import Lock, local
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# store shared by the workers of a deployment, e.g. sqlite:////data/shared.db or redis://redis:6379/0
+# every worker keeps its own state if empty
+SHARED_STORE_URL = os.getenv("SHARED_STORE_URL", "")
+# seconds a redis leader keeps the leadership without renewing it
+LEADER_TTL = int(os.getenv("LEADER_TTL", 900))
+LEADER_KEY = "leader"
+
+
+class SharedStore(abc.ABC):
+    """
+    Key value store of bytes shared by the workers of a deployment.
+    Errors of the backend are logged and handled like missing entries,
+    so a worker keeps serving its local state if the store is not reachable.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes:
+        """
+        Returns the value of key or None if there is no valid one.
+        """
+
+    @abc.abstractmethod
+    def set(self, key: str, value: bytes, ttl: float = None):
+        """
+        :param ttl: seconds the value stays valid, forever if None
+        """
+
+    @abc.abstractmethod
+    def try_acquire_leadership(self) -> bool:
+        """
+        Returns True if this worker is the leader, the one that ingests the search analytics.
+        Has to be called regularly, a leader that stops calling it loses the leadership.
+        """
+
+    def close(self):
+        pass
+
+
+class MemoryStore(SharedStore):
+    """
+    Store in the memory of this process, the single worker is always the leader.
+    """
+
+    def __init__(self) -> None:
+        # key -> (expiry time, value)
+        self.entries: dict[str, tuple[float, bytes]] = {}
+        self._lock = Lock()
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            expires, value = self.entries.get(key, (None, None))
+        if expires is not None and expires < time():
+            return None
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        with self._lock:
+            self.entries[key] = (time() + ttl if ttl is not None else None, value)
+
+    def try_acquire_leadership(self) -> bool:
+        return True
+
+
+class SQLiteStore(SharedStore):
+    """
+    Store in a sqlite database, for workers on the same host.
+    The leader holds an exclusive lock on a file next to the database until its process exits.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.leader_path = path + ".leader"
+        self._local = local()
+        self._leader_file = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Returns the connection of the calling thread, sqlite connections can not be shared between threads.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # readers do not block the writer
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> bytes:
+        try:
+            row = self.connection().execute(
+                "SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            logger.exception(f"could not read {key} from the shared store: {self.path}")
+            return None
+        if row is None or (row[1] is not None and row[1] < time()):
+            return None
+        return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        now = time()
+        try:
+            conn = self.connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl is not None else None))
+            conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+        except sqlite3.Error:
+            logger.exception(f"could not write {key} to the shared store: {self.path}")
+
+    def try_acquire_leadership(self) -> bool:
+        import fcntl
+
+        if self._leader_file is not None:
+            return True
+        leader_file = open(self.leader_path, "a")
+        try:
+            fcntl.flock(leader_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            leader_file.close()
+            return False
+        logger.info(f"became the leader, pid: {os.getpid()}")
+        self._leader_file = leader_file
+        return True
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        if self._leader_file is not None:
+            self._leader_file.close()
+            self._leader_file = None
+
+
+class RedisStore(SharedStore):
+    """
+    Store in redis, for workers on several hosts. Needs the redis package.
+    The leader holds a key with its worker id that expires after leader_ttl seconds if it is not renewed.
+    """
+
+    def __init__(self, url: str, leader_ttl: int = LEADER_TTL) -> None:
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.errors = (redis.RedisError,)
+        self.leader_ttl = leader_ttl
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4()}"
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self.client.get(key)
+        except self.errors:
+            logger.exception(f"could not read {key} from the shared store")
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        try:
+            self.client.set(key, value, px=int(ttl * 1000) if ttl is not None else None)
+        except self.errors:
+            logger.exception(f"could not write {key} to the shared store")
+
+    def try_acquire_leadership(self) -> bool:
+        ttl_ms = self.leader_ttl * 1000
+        try:
+            if self.client.set(LEADER_KEY, self.worker_id, nx=True, px=ttl_ms):
+                logger.info(f"became the leader, worker: {self.worker_id}")
+                return True
+            if self.client.get(LEADER_KEY) == self.worker_id.encode():
+                self.client.pexpire(LEADER_KEY, ttl_ms)
+                return True
+        except self.errors:
+            logger.exception("could not acquire the leadership")
+        return False
+
+    def close(self):
+        self.client.close()
+
+
+def open_shared_store(url: str = SHARED_STORE_URL) -> SharedStore:
+    """
+    Returns the store for url, None if url is empty.
+    Supported are sqlite:///relative/path, sqlite:////absolute/path, redis://host:port/db and memory://.
+    """
+    if not url:
+        return None
+    scheme, _, location = url.partition("://")
+    if scheme == "sqlite":
+        return SQLiteStore(location[1:] if location.startswith("/") else location)
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisStore(url)
+    if scheme == "memory":
+        return MemoryStore()
+    raise ValueError(f"unsupported shared store: {url}")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from typing import Iterable
+
+from oeh_data_dashboard.helper_classes import DayBuckets, SearchedMaterialInfo
+
+logger = logging.getLogger(__name__)
+
+# path of the snapshot file, no snapshots are written if empty
+ANALYTICS_SNAPSHOT_PATH = os.getenv("ANALYTICS_SNAPSHOT_PATH", "")
+# increase if the schema changes, older snapshots are ignored then
+SNAPSHOT_VERSION = 3
+MATERIAL_COLUMNS = ("id", "search_strings", "clicks", "name", "title", "content_url", "crawler", "creator", "last_click", "fps")
+
+
+def material_to_row(m: SearchedMaterialInfo) -> tuple:
+    return (
+        m._id,
+        json.dumps(m.search_strings),
+        m.clicks,
+        m.name,
+        m.title,
+        m.content_url,
+        m.crawler,
+        m.creator,
+        m.last_click,
+        json.dumps(m.fps)
+    )
+
+
+def material_from_row(row: tuple) -> SearchedMaterialInfo:
+    _id, search_strings, clicks, name, title, content_url, crawler, creator, last_click, fps = row
+    return SearchedMaterialInfo(
+        _id=_id,
+        search_strings=json.loads(search_strings),
+        clicks=clicks,
+        name=name,
+        title=title,
+        content_url=content_url,
+        crawler=crawler,
+        creator=creator,
+        last_click=last_click,
+        fps=json.loads(fps)
+    )
+
+
+def dump_analytics(
+    materials: Iterable[SearchedMaterialInfo],
+    last_timestamp: str,
+    day_counts: dict[str, DayBuckets]
+) -> bytes:
+    """
+    Returns the materials, in their order, the watermark and the daily counts by name as compressed json.
+    """
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "last_timestamp": last_timestamp,
+        "materials": [material_to_row(m) for m in materials],
+        "day_counts": {name: counts.to_rows() for name, counts in day_counts.items()}
+    }
+    return zlib.compress(json.dumps(data).encode())
+
+
+def load_analytics(data: bytes) -> tuple[list[SearchedMaterialInfo], str, dict[str, list[tuple]]]:
+    """
+    Returns the materials, the watermark and the rows of the daily counts by name of dump_analytics,
+    None if they are of another version.
+    """
+    data = json.loads(zlib.decompress(data))
+    if data.get("version") != SNAPSHOT_VERSION:
+        return None
+    return [material_from_row(row) for row in data["materials"]], data["last_timestamp"], data["day_counts"]
+
+
+class AnalyticsSnapshot:
+    """
+    SQLite file with the searched materials, their daily counts
+    and the timestamp of the last ingested event (watermark), so a restarted service only has to ingest newer events.
+    """
+
+    def __init__(self, path: str = ANALYTICS_SNAPSHOT_PATH) -> None:
+        self.path = path
+
+    def save(self, materials: Iterable[SearchedMaterialInfo], last_timestamp: str, day_counts: dict[str, DayBuckets]):
+        """
+        Replaces the snapshot with the given materials, in their order, the watermark and the daily counts by name.
+        The snapshot is written to a temporary file first, so a crash never leaves a broken snapshot.
+        """
+        rows = [(position, *material_to_row(m)) for position, m in enumerate(materials)]
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        with conn:
+            conn.execute(
+                "CREATE TABLE materials (position INTEGER PRIMARY KEY, id TEXT, search_strings TEXT, clicks INTEGER, "
+                "name TEXT, title TEXT, content_url TEXT, crawler TEXT, creator TEXT, last_click REAL, fps TEXT)")
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE day_counts (name TEXT, day INTEGER, key TEXT, count INTEGER)")
+            conn.executemany("INSERT INTO materials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            for name, counts in day_counts.items():
+                conn.executemany(
+                    "INSERT INTO day_counts VALUES (?, ?, ?, ?)", ((name, *row) for row in counts.to_rows()))
+            conn.execute("INSERT INTO meta VALUES ('last_timestamp', ?)", (last_timestamp,))
+            conn.execute(f"PRAGMA user_version = {SNAPSHOT_VERSION}")
+        conn.close()
+        os.replace(tmp_path, self.path)
+        logger.info(f"saved analytics snapshot with {len(rows)} materials up to {last_timestamp}")
+
+    def load(self) -> tuple[list[SearchedMaterialInfo], str, dict[str, list[tuple]]]:
+        """
+        Returns the materials in their saved order, the watermark and the rows of the daily counts by name,
+        None if there is no snapshot of the current version.
+        """
+        if not os.path.exists(self.path):
+            return None
+        conn = sqlite3.connect(self.path)
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SNAPSHOT_VERSION:
+                logger.warning(f"ignoring analytics snapshot of another version: {self.path}")
+                return None
+            last_timestamp: str = conn.execute(
+                "SELECT value FROM meta WHERE key = 'last_timestamp'").fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {', '.join(MATERIAL_COLUMNS)} FROM materials ORDER BY position").fetchall()
+            day_counts: dict[str, list[tuple]] = {}
+            for name, day, key, count in conn.execute("SELECT name, day, key, count FROM day_counts"):
+                day_counts.setdefault(name, []).append((day, key, count))
+        except sqlite3.Error:
+            logger.exception(f"could not load analytics snapshot: {self.path}")
+            return None
+        finally:
+            conn.close()
+
+        materials = [material_from_row(row) for row in rows]
+        logger.info(f"loaded analytics snapshot with {len(materials)} materials up to {last_timestamp}")
+        return materials, last_timestamp, day_counts
@@ -0,0 +1,69 @@
+import unittest
+
+from oeh_data_dashboard.helper_classes import CollectionTree, DayBuckets
+
+DAY = 24 * 3600
+
+# fp
+# ├── a
+# │   ├── a1
+# │   └── a2
+# └── b
+COLLECTIONS = {
+    "fp": ("Fachportal", ["root"]),
+    "a": ("A", ["root", "fp"]),
+    "a1": ("A1", ["root", "fp", "a"]),
+    "a2": ("A2", ["root", "fp", "a"]),
+    "b": ("B", ["root", "fp"]),
+}
+
+
+class CollectionTreeTest(unittest.TestCase):
+    def test_rolls_up_direct_counts(self):
+        tree = CollectionTree(COLLECTIONS, {"a1": 2, "a2": 3, "b": 1})
+        self.assertEqual(tree.subtree_counts, {"fp": 6, "a": 5, "a1": 2, "a2": 3, "b": 1})
+        self.assertEqual(tree.direct_counts["a"], 0)
+
+    def test_distinct_subtree_counts(self):
+        # the same 2 documents are in a1 and a2, so a holds 2 documents and not 4
+        tree = CollectionTree(
+            COLLECTIONS, {"a1": 2, "a2": 2, "b": 5}, subtree_counts={"fp": 7, "a": 2, "a1": 2, "a2": 2, "b": 5})
+        empty = {info._id for info in tree.empty_collections("fp", doc_threshold=3)}
+        self.assertEqual(empty, {"a", "a1", "a2"})
+
+    def test_empty_collections(self):
+        tree = CollectionTree(COLLECTIONS, {"a1": 2, "b": 1})
+        self.assertEqual({info._id for info in tree.empty_collections("fp")}, {"a2"})
+        self.assertEqual({info._id for info in tree.empty_collections("a", doc_threshold=2)}, {"a1", "a2"})
+        self.assertEqual(tree.empty_collections("b"), set())
+        self.assertEqual(len(tree), 5)
+
+
+class DayBucketsTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100 * DAY + 3600
+        self.buckets = DayBuckets(7)
+        self.buckets.add("x", self.now - 8 * DAY)  # older than the ring
+        self.buckets.add("x", self.now - 6 * DAY)
+        self.buckets.add("x", self.now - DAY, 2)
+        self.buckets.add("y", self.now)
+
+    def test_count_in_window(self):
+        self.assertEqual(self.buckets.count("x", 1, self.now), 0)
+        self.assertEqual(self.buckets.count("x", 2, self.now), 2)
+        self.assertEqual(self.buckets.count("x", 7, self.now), 3)
+        self.assertEqual(self.buckets.count("x", 30, self.now), 3)
+        self.assertEqual(self.buckets.totals(7, self.now), {"x": 3, "y": 1})
+
+    def test_advancing_expires_old_days(self):
+        self.assertEqual(self.buckets.totals(7, self.now + 2 * DAY), {"x": 2, "y": 1})
+        self.assertEqual(self.buckets.totals(7, self.now + 30 * DAY), {})
+
+    def test_rows_round_trip(self):
+        restored = DayBuckets.from_rows(7, self.buckets.to_rows())
+        self.assertEqual(restored.totals(7, self.now), self.buckets.totals(7, self.now))
+        self.assertEqual(restored.count("x", 2, self.now), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
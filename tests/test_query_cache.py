@@ -0,0 +1,70 @@
+import unittest
+from unittest import mock
+
+from oeh_data_dashboard.oeh_elastic.query_cache import QueryCache
+from oeh_data_dashboard.oeh_elastic.shared_store import MemoryStore
+
+BODY = {"query": {"match_all": {}}}
+
+
+def result(i: int) -> dict:
+    # 40 bytes as json
+    return {"x": f"{i}".ljust(31, "a")}
+
+
+class QueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("oeh_data_dashboard.oeh_elastic.query_cache.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = QueryCache(max_bytes=100, ttls={"short": 10}, default_ttl=60)
+
+    def test_expiry(self):
+        self.cache.set("short", BODY, {"a": 1})
+        self.cache.set("other", BODY, {"b": 1})
+        self.now += 30
+        self.assertIsNone(self.cache.get("short", BODY))
+        self.assertEqual(self.cache.get("other", BODY), {"b": 1})
+        self.now += 31
+        self.assertIsNone(self.cache.get("other", BODY))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_get_stale_after_expiry(self):
+        self.cache.set("short", BODY, {"a": 1})
+        self.now += 30
+        self.assertIsNone(self.cache.get("short", BODY))
+        self.assertEqual(self.cache.get_stale("short", BODY), {"a": 1})
+        self.assertIsNone(self.cache.get_stale("other", BODY))
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        for i in range(3):
+            self.cache.set("other", {"i": i}, result(i))
+        # 3 * 40 bytes exceed 100, the oldest result is evicted
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.size, 80)
+        self.assertIsNone(self.cache.get("other", {"i": 0}))
+
+        # reading a result makes it the most recently used one
+        self.assertEqual(self.cache.get("other", {"i": 1}), result(1))
+        self.cache.set("other", {"i": 3}, result(3))
+        self.assertIsNone(self.cache.get("other", {"i": 2}))
+        self.assertEqual(self.cache.get("other", {"i": 1}), result(1))
+        self.assertEqual(self.cache.stats()["evictions"], 2)
+
+    def test_skips_results_larger_than_max_bytes(self):
+        self.cache.set("other", BODY, {"x": "a" * 100})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_shared_store(self):
+        store = MemoryStore()
+        QueryCache(shared=store).set("workspace", BODY, {"a": 1})
+        other = QueryCache(shared=store)
+        self.assertEqual(other.get("workspace", BODY), {"a": 1})
+        self.assertEqual(other.stats()["shared_hits"], 1)
+        self.assertEqual(len(other), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
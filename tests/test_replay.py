@@ -0,0 +1,38 @@
+import json
+import unittest
+
+from elasticsearch import RequestError
+
+from oeh_data_dashboard.benchmarks.replay import SyntheticElastic
+
+
+class SyntheticElasticTest(unittest.TestCase):
+    def setUp(self):
+        self.elastic = SyntheticElastic(fachportale=2, collections=10, materials=100, events=10)
+
+    def test_rejects_text_fields(self):
+        for body in (
+            {"sort": [{"nodeRef.id": "asc"}]},
+            {"query": {"terms": {"nodeRef.id": ["000000001"]}}},
+            {"aggs": {"a": {"terms": {"field": "properties.cm:creator"}}}},
+        ):
+            with self.subTest(body=body), self.assertRaises(RequestError):
+                self.elastic("POST", "/workspace/_search", body=body)
+
+    def test_accepts_keyword_fields(self):
+        r = self.elastic("POST", "/workspace/_search", body={
+            "query": {"terms": {"nodeRef.id.keyword": ["000000001", "000000002"]}},
+            "sort": [{"nodeRef.id.keyword": "asc"}],
+            "aggs": {"a": {"terms": {"field": "properties.cm:creator.keyword"}}},
+        })
+        self.assertEqual([hit["_id"] for hit in r["hits"]["hits"]], ["000000001", "000000002"])
+
+    def test_msearch_item_error(self):
+        lines = [{"index": "workspace"}, {"sort": [{"nodeRef.id": "asc"}]}, {"index": "workspace"}, {"size": 1}]
+        r = self.elastic("POST", "/_msearch", body="\n".join(json.dumps(line) for line in lines) + "\n")
+        self.assertEqual(r["responses"][0]["status"], 400)
+        self.assertEqual(len(r["responses"][1]["hits"]["hits"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from time import monotonic
+
+from oeh_data_dashboard.oeh_elastic.resilience import CircuitBreaker, RetryPolicy, ServiceUnavailableError
+
+
+class ServiceError(Exception):
+    pass
+
+
+class QueryError(Exception):
+    pass
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+        self.policy = RetryPolicy(
+            max_retries=0, retry_on=(ConnectionError,), is_failure=lambda e: isinstance(e, ServiceError))
+
+    def open_circuit(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "open")
+
+    def expire_timeout(self):
+        self.breaker.opened_at = monotonic() - self.breaker.reset_timeout
+        self.assertEqual(self.breaker.state, "half_open")
+
+    def call(self, exception: Exception = None):
+        def func():
+            if exception is not None:
+                raise exception
+            return "ok"
+        return self.policy.call(func, self.breaker)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "closed")
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "open")
+        with self.assertRaises(ServiceUnavailableError):
+            self.call()
+
+    def test_half_open_success_closes(self):
+        self.open_circuit()
+        self.expire_timeout()
+        self.assertEqual(self.call(), "ok")
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_half_open_lets_a_single_trial_through(self):
+        self.open_circuit()
+        self.expire_timeout()
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_half_open_retried_failure_opens(self):
+        self.open_circuit()
+        self.expire_timeout()
+        with self.assertRaises(ServiceUnavailableError):
+            self.call(ConnectionError())
+        self.assertEqual(self.breaker.state, "open")
+
+    def test_half_open_service_error_opens(self):
+        self.open_circuit()
+        self.expire_timeout()
+        with self.assertRaises(ServiceError):
+            self.call(ServiceError())
+        self.assertEqual(self.breaker.state, "open")
+
+    def test_half_open_other_error_releases_trial(self):
+        self.open_circuit()
+        self.expire_timeout()
+        with self.assertRaises(QueryError):
+            self.call(QueryError())
+        self.assertEqual(self.breaker.state, "half_open")
+        self.assertEqual(self.call(), "ok")
+        self.assertEqual(self.breaker.state, "closed")
+
+
+if __name__ == "__main__":
+    unittest.main()
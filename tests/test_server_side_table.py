@@ -0,0 +1,34 @@
+import unittest
+
+import pandas as pd
+
+from oeh_data_dashboard.fachportal.server_side_table import query_table, split_filter_part
+
+
+class QueryTableTest(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({"key": ["10", "9", "mathe", "Physik"], "doc_count": [1, 20, 3, 10]})
+
+    def query(self, filter_query: str, sort_by: list = None) -> list:
+        return query_table(self.df, sort_by, filter_query)["key"].tolist()
+
+    def test_split_filter_part(self):
+        self.assertEqual(split_filter_part("{doc_count} ge 10"), ("doc_count", "ge", 10.0, "10"))
+        self.assertEqual(split_filter_part('{key} icontains "a b"'), ("key", "contains", "a b", "a b"))
+        self.assertEqual(split_filter_part("no filter"), (None, None, None, None))
+
+    def test_number_on_string_column(self):
+        self.assertEqual(self.query("{key} = 10"), ["10"])
+        self.assertEqual(self.query("{key} ne 10"), ["9", "mathe", "Physik"])
+
+    def test_number_on_numeric_column(self):
+        self.assertEqual(self.query("{doc_count} >= 10"), ["9", "Physik"])
+        self.assertEqual(self.query("{doc_count} = 10"), ["Physik"])
+
+    def test_contains_and_sort(self):
+        self.assertEqual(self.query("{key} contains h"), ["mathe", "Physik"])
+        self.assertEqual(self.query("", [{"column_id": "doc_count", "direction": "desc"}]), ["9", "Physik", "mathe", "10"])
+
+
+if __name__ == "__main__":
+    unittest.main()
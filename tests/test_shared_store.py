@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from oeh_data_dashboard.oeh_elastic.shared_store import MemoryStore, SharedStore, SQLiteStore, open_shared_store
+
+
+class SQLiteStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "shared.db")
+
+    def open(self) -> SQLiteStore:
+        store = SQLiteStore(self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def test_get_set(self):
+        store = self.open()
+        store.set("a", b"1")
+        store.set("expired", b"2", ttl=-1)
+        self.assertEqual(self.open().get("a"), b"1")
+        self.assertIsNone(store.get("expired"))
+        self.assertIsNone(store.get("missing"))
+
+    def test_single_leader(self):
+        first, second = self.open(), self.open()
+        self.assertTrue(first.try_acquire_leadership())
+        self.assertTrue(first.try_acquire_leadership())
+        self.assertFalse(second.try_acquire_leadership())
+        # the leadership is released when the leader goes away
+        first.close()
+        self.assertTrue(second.try_acquire_leadership())
+
+
+class SharedStoreTest(unittest.TestCase):
+    def test_memory_store(self):
+        store = open_shared_store("memory://")
+        self.assertIsInstance(store, MemoryStore)
+        store.set("a", b"1", ttl=60)
+        store.set("expired", b"2", ttl=-1)
+        self.assertEqual(store.get("a"), b"1")
+        self.assertIsNone(store.get("expired"))
+        self.assertTrue(store.try_acquire_leadership())
+
+    def test_open_shared_store(self):
+        self.assertIsNone(open_shared_store(""))
+        with self.assertRaises(ValueError):
+            open_shared_store("ftp://host")
+
+    def test_incomplete_store(self):
+        class GetOnlyStore(SharedStore):
+            def get(self, key: str) -> bytes:
+                return None
+
+        with self.assertRaises(TypeError):
+            GetOnlyStore()
+
+
+if __name__ == "__main__":
+    unittest.main()
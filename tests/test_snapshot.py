@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from oeh_data_dashboard.helper_classes import DayBuckets, SearchedMaterialInfo
+from oeh_data_dashboard.oeh_elastic import snapshot
+from oeh_data_dashboard.oeh_elastic.snapshot import (AnalyticsSnapshot, dump_analytics, load_analytics,
+                                                     material_to_row)
+
+NOW = 100 * 24 * 3600
+LAST_TIMESTAMP = "2021-07-01T10:00:00.000Z"
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.materials = [
+            SearchedMaterialInfo(
+                _id="m1", search_strings={"mathe": 2}, clicks=2, name="n1", title="Titel 1", last_click=NOW,
+                fps=["fp"]),
+            SearchedMaterialInfo(_id="m0", clicks=1, last_click=NOW - 3600),
+        ]
+        self.clicks = DayBuckets(7)
+        self.clicks.add("m1", NOW, 2)
+        self.clicks.add("m0", NOW - 3600)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "snapshots", "analytics.db")
+
+    def assert_loaded(self, loaded):
+        materials, last_timestamp, day_counts = loaded
+        self.assertEqual([material_to_row(m) for m in materials], [material_to_row(m) for m in self.materials])
+        self.assertEqual(last_timestamp, LAST_TIMESTAMP)
+        self.assertEqual(DayBuckets.from_rows(7, day_counts["clicks"]).totals(7, NOW), {"m1": 2, "m0": 1})
+
+    def test_file_round_trip(self):
+        AnalyticsSnapshot(self.path).save(self.materials, LAST_TIMESTAMP, {"clicks": self.clicks})
+        self.assert_loaded(AnalyticsSnapshot(self.path).load())
+
+    def test_bytes_round_trip(self):
+        self.assert_loaded(load_analytics(dump_analytics(self.materials, LAST_TIMESTAMP, {"clicks": self.clicks})))
+
+    def test_rejects_older_version(self):
+        with mock.patch.object(snapshot, "SNAPSHOT_VERSION", snapshot.SNAPSHOT_VERSION - 1):
+            AnalyticsSnapshot(self.path).save(self.materials, LAST_TIMESTAMP, {"clicks": self.clicks})
+            data = dump_analytics(self.materials, LAST_TIMESTAMP, {"clicks": self.clicks})
+        self.assertIsNone(AnalyticsSnapshot(self.path).load())
+        self.assertIsNone(load_analytics(data))
+
+    def test_missing_file(self):
+        self.assertIsNone(AnalyticsSnapshot(self.path).load())
+
+
+if __name__ == "__main__":
+    unittest.main()